@@ -2,9 +2,14 @@
 Copyright 2009-2015 Olivier Belanger - modifications by Hans-Jörg Bibiko 2022
 """
 import codecs
+import collections
+import itertools
 import os
+import queue
 import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 import Resources.variables as vars
 from Resources.utils import *
 
@@ -15,6 +20,10 @@ else:
     from pyo64 import *
 
 from .pyotools import PWM, VCO
+from Resources.soundfiles import get_frame_size, read_frames, read_header
+from Resources.exportanalysis import decode, numpy, resample
+import Resources.samplestream as samplestream
+from Resources.samplecache import get_sample_cache
 
 
 def get_output_devices():
@@ -79,29 +88,24 @@ class GraphicalDelAdsr(Expseg):
                 self.SetList(list(map(lambda x: (x[0] * dur, x[1]), self.grapher.getPoints())))
 
     def setMode(self, mode):
-        if self.mode != mode and self.grapher is not None:
+        if self.mode != mode:
             self.mode = mode
             if mode == 0:
-                self.grapher.mode = 2
                 self.loop = False
                 self.inverse = False
-                self.grapher.inverse = False
             elif mode == 1:
-                self.grapher.mode = 2
                 self.loop = True
                 self.inverse = False
-                self.grapher.inverse = False
             elif mode == 2:
-                self.grapher.mode = 2
                 self.loop = False
                 self.inverse = True
-                self.grapher.inverse = True
             elif mode == 3:
-                self.grapher.mode = 2
                 self.loop = True
                 self.inverse = True
-                self.grapher.inverse = True
-            wx.CallAfter(self.grapher.Refresh)
+            if self.grapher is not None:
+                self.grapher.mode = 2
+                self.grapher.inverse = self.inverse
+                wx.CallAfter(self.grapher.Refresh)
 
     def initPanel(self, pts=None, grapher=None, size=None):
         if self.grapher is None and grapher is not None:
@@ -122,14 +126,13 @@ class GraphicalDelAdsr(Expseg):
 
 
 class FSServer:
-    def __init__(self):
-        self.eqOn = False
-        self.revOn = False
-        self.compOn = False
+    def __init__(self, audio=None):
         self.eqFreq = [100, 500, 2000]
         self.eqGain = [1, 1, 1, 1]
         self.wasMidiActive = False
-        self.server = Server(duplex=0, audio=vars.vars["AUDIO_HOST"].lower())
+        if audio is None:
+            audio = vars.vars["AUDIO_HOST"]
+        self.server = Server(duplex=0, audio=audio.lower())
         self.boot()
 
     def scanning(self, ctlnum, midichnl):
@@ -164,49 +167,42 @@ class FSServer:
         self.server.stop()
 
     def shutdown(self):
-        for o in ["_outComp", "_compLevel", "_compDelay", "_outRevMix", "_outRev", "_stRev",
-                  "_outEqMix", "_outEq", "_fbEq", "_fbEqAmps", "_outSigMix", "_outSig", "_modMix"]:
-            if hasattr(self, o):
-                delattr(self, o)
+        self.deletePostProcChain()
         self.server.shutdown()
 
     def boot(self):
         self.server.boot()
-
-        self._modMix = Sig([0, 0])
-        self._outSig = Sig(self._modMix).out()
-        self._outSigMix = self._outSig.mix(1)
-
-        self._fbEqAmps = SigTo(self.eqGain, time=.1, init=self.eqGain)
-        self._fbEq = FourBand(self._outSig,
-                              freq1=self.eqFreq[0], freq2=self.eqFreq[1],
-                              freq3=self.eqFreq[2], mul=self._fbEqAmps).stop()
-        self._outEq = Mix(self._fbEq, voices=2).stop()
-        self._outEqMix = self._outEq.mix(1)
-
-        self._stRev = STRev(self._outSig, inpos=[0.0, 1.0], revtime=2,
-                            cutoff=5000, bal=0.25, roomSize=1).stop()
-        self._outRev = self._stRev.mix(2).stop()
-        self._outRevMix = self._outRev.mix(2)
-
-        self._compLevel = Compress(self._outSigMix, thresh=-3, ratio=2, risetime=.01,
-                                   falltime=.1, lookahead=0, knee=0.5, outputAmp=True).stop()
-        self._compDelay = Delay(self._outSig, delay=0.005).stop()
-        self._outComp = self._compDelay * self._compLevel
-        self._outComp.stop()
+        self.createPostProcChain()
 
         vars.vars["MIDI_ACTIVE"] = self.server.getMidiActive()
 
-        if vars.constants["IS_MAC"] and self.server._audio not in ["offline"]:
+        if vars.constants["IS_MAC"] and self.server._audio not in ["offline", "manual"]:
             if self.wasMidiActive and vars.vars["MIDI_ACTIVE"] == 0:
                 wx.MessageBox("Lost MIDI interface")
 
         if vars.vars["MIDI_ACTIVE"] == 1:
             self.wasMidiActive = True
 
+    def deletePostProcChain(self):
+        if hasattr(self, "chain"):
+            # keeps the equalizer settings for the next chain
+            self.eqFreq, self.eqGain = self.chain.eqFreq, self.chain.eqGain
+            del self.chain
+
+    def resetPostProcChain(self):
+        # fresh output objects without rebooting the server, e.g. between offline renderings
+        self.deletePostProcChain()
+        self.createPostProcChain()
+
+    def createPostProcChain(self):
+        self.chain = PostProcChain(0, self.eqFreq, self.eqGain)
+
     def reinit(self, audio):
         self.server.reinit(duplex=0, audio=audio.lower())
 
+    def setModulesOutput(self, outs):
+        self.chain.setModulesOutput(outs)
+
     def setAmpCallable(self, callable):
         self.server._server.setAmpCallable(callable)
 
@@ -219,6 +215,9 @@ class FSServer:
     def setAmp(self, amp):
         self.server.amp = amp
 
+    def getAmp(self):
+        return self.server.amp
+
     def setOutputDevice(self, device):
         if vars.vars["AUDIO_HOST"] != "Jack":
             self.server.setOutputDevice(device)
@@ -229,9 +228,100 @@ class FSServer:
     def setSamplingRate(self, sr):
         self.server.setSamplingRate(sr)
 
+    def setNchnls(self, nchnls):
+        self.server.setNchnls(nchnls)
+
+    def setRandomSeed(self, seed):
+        """
+        Seeds the random values of the synths built from now on, drawn with the
+        random module or by the random objects of pyo. 0 seeds them from the clock.
+        """
+        random.seed(seed or None)
+        self.server.setGlobalSeed(int(seed))
+
+    def process(self):
+        # computes one buffer, only for a server booted with audio="manual"
+        self.server.process()
+
     def recordOptions(self, dur, filename, fileformat, sampletype):
         self.server.recordOptions(dur=dur, filename=filename, fileformat=fileformat, sampletype=sampletype)
 
+    def onOffEq(self, state):
+        self.chain.onOffEq(state)
+
+    def setEqFreq(self, which, freq):
+        self.chain.setEqFreq(which, freq)
+
+    def setEqGain(self, which, gain):
+        self.chain.setEqGain(which, gain)
+
+    def onOffRev(self, state):
+        self.chain.onOffRev(state)
+
+    def setRevParam(self, param, value):
+        self.chain.setRevParam(param, value)
+
+    def onOffComp(self, state):
+        self.chain.onOffComp(state)
+
+    def setCompParam(self, param, value):
+        self.chain.setCompParam(param, value)
+
+    def setPostProcSettings(self, postProcSettings):
+        self.chain.setPostProcSettings(postProcSettings)
+
+    def getOutput(self):
+        return self.chain.getOutput()
+
+
+class PostProcChain:
+    """
+    Mix of the module outputs followed by the equalizer, the reverb and the
+    compressor of the server panel, sent to the output channels `chnl` and
+    `chnl` + 1.
+    """
+    def __init__(self, chnl=0, eqFreq=[100, 500, 2000], eqGain=[1, 1, 1, 1]):
+        self.chnl = chnl
+        self.eqOn = False
+        self.revOn = False
+        self.compOn = False
+        self.eqFreq = list(eqFreq)
+        self.eqGain = list(eqGain)
+
+        self._modMix = Sig([0, 0])
+        self._outSig = Sig(self._modMix).out(self.chnl)
+        self._outSigMix = self._outSig.mix(1)
+
+        self._fbEqAmps = SigTo(self.eqGain, time=.1, init=self.eqGain)
+        self._fbEq = FourBand(self._outSig,
+                              freq1=self.eqFreq[0], freq2=self.eqFreq[1],
+                              freq3=self.eqFreq[2], mul=self._fbEqAmps).stop()
+        self._outEq = Mix(self._fbEq, voices=2).stop()
+        self._outEqMix = self._outEq.mix(1)
+
+        self._stRev = STRev(self._outSig, inpos=[0.0, 1.0], revtime=2,
+                            cutoff=5000, bal=0.25, roomSize=1).stop()
+        self._outRev = self._stRev.mix(2).stop()
+        self._outRevMix = self._outRev.mix(2)
+
+        self._compLevel = Compress(self._outSigMix, thresh=-3, ratio=2, risetime=.01,
+                                   falltime=.1, lookahead=0, knee=0.5, outputAmp=True).stop()
+        self._compDelay = Delay(self._outSig, delay=0.005).stop()
+        self._outComp = self._compDelay * self._compLevel
+        self._outComp.stop()
+
+    def setModulesOutput(self, outs):
+        if len(outs) == 0:
+            out = Sig(0.0)
+        else:
+            for i, o in enumerate(outs):
+                if i == 0:
+                    out = Sig(o)
+                else:
+                    out = out + Sig(o)
+        self._modMix.value = out
+        self._outSig.value = self._modMix
+
     def onOffEq(self, state):
         self.eqOn = bool(state)
         self.handlePostProcChain()
@@ -285,6 +375,33 @@ class FSServer:
         elif param == "falltime":
             self._compLevel.falltime = value
 
+    def setPostProcSettings(self, postProcSettings):
+        eq = postProcSettings["EQ"]
+        comp = postProcSettings["Comp"]
+        rev = postProcSettings.get("Rev", [False, 0.5, -3.0, 0.5, 1.0, 1.0, 5000.0])
+        for i in range(3):
+            self.setEqFreq(i, eq[i + 1])
+        for i in range(4):
+            self.setEqGain(i, p_mathpow(10.0, eq[i + 4] * 0.05))
+        for param, value in zip(["bal", "refgain", "inpos", "time", "size", "cutoff"], rev[1:]):
+            self.setRevParam(param, value)
+        for param, value in zip(["thresh", "ratio", "risetime", "falltime"], comp[1:]):
+            self.setCompParam(param, value)
+        self.eqOn = bool(eq[0])
+        self.revOn = bool(rev[0])
+        self.compOn = bool(comp[0])
+        self.handlePostProcChain()
+
+    def getOutput(self):
+        # the last object of the post-processing chain, as chosen by handlePostProcChain
+        if self.compOn:
+            return self._outComp
+        elif self.revOn:
+            return self._outRev
+        elif self.eqOn:
+            return self._outEq
+        return self._outSig
+
     def handlePostProcChain(self):
 
         if not self.eqOn:
@@ -299,31 +416,31 @@ class FSServer:
         self._outSig.play()
 
         if not self.eqOn and not self.revOn and not self.compOn:
-            self._outSig.out()
+            self._outSig.out(self.chnl)
 
         elif self.eqOn and not self.revOn and not self.compOn:
             self._fbEq.setInput(self._outSig, fadetime=2.0)
             self._fbEq.play()
-            self._outEq.out()
+            self._outEq.out(self.chnl)
 
         elif not self.eqOn and self.revOn and not self.compOn:
             self._stRev.setInput(self._outSig, fadetime=2.0)
             self._stRev.play()
-            self._outRev.out()
+            self._outRev.out(self.chnl)
 
         elif not self.eqOn and not self.revOn and self.compOn:
             self._compLevel.setInput(self._outSigMix, fadetime=2.0)
             self._compDelay.setInput(self._outSig, fadetime=2.0)
             self._compLevel.play()
             self._compDelay.play()
-            self._outComp.out()
+            self._outComp.out(self.chnl)
 
         elif self.eqOn and self.revOn and not self.compOn:
             self._stRev.setInput(self._outEq, fadetime=2.0)
             self._fbEq.play()
             self._outEq.play()
             self._stRev.play()
-            self._outRev.out()
+            self._outRev.out(self.chnl)
 
         elif self.eqOn and self.revOn and self.compOn:
             self._stRev.setInput(self._outEq, fadetime=2.0)
@@ -335,7 +452,7 @@ class FSServer:
             self._outRev.play()
             self._compLevel.play()
             self._compDelay.play()
-            self._outComp.out()
+            self._outComp.out(self.chnl)
 
         elif not self.eqOn and self.revOn and self.compOn:
             self._stRev.setInput(self._outSig, fadetime=2.0)
@@ -345,7 +462,7 @@ class FSServer:
             self._outRev.play()
             self._compLevel.play()
             self._compDelay.play()
-            self._outComp.out()
+            self._outComp.out(self.chnl)
 
         elif self.eqOn and not self.revOn and self.compOn:
             self._compLevel.setInput(self._outEqMix, fadetime=2.0)
@@ -354,7 +471,27 @@ class FSServer:
             self._outEq.play()
             self._compLevel.play()
             self._compDelay.play()
-            self._outComp.out()
+            self._outComp.out(self.chnl)
+
+
+class TableCapture:
+    """
+    Records the stereo signal `sig` into a table of `dur` seconds, from the
+    next buffer computed after start(). The samples are read back through the
+    buffer protocol of the table, eg. as numpy arrays, without copying them.
+    """
+    def __init__(self, sig, dur):
+        self.table = NewTable(dur, chnls=2)
+        self.rec = TableRec(sig, self.table)
+
+    def start(self):
+        self.rec.play()
+
+    def getSize(self):
+        return self.table.getSize()
+
+    def getBuffers(self):
+        return [self.table.getBuffer(i) for i in range(2)]
 
 
 class CtlBind:
@@ -657,29 +794,18 @@ class BaseSynth:
         if vars.vars["MIDIPITCH"] is not None:
             self._note = Sig(vars.vars["MIDIPITCH"])
             self._transpo = Sig(value=0)
-            self.pitch = Snap(self._note+self._transpo, choice=list(range(12)), scale=self.scaling)
-            if mode == 1:
-                if type(vars.vars["MIDIPITCH"]) is list:
-                    _tmp_hz = [midiToHz(x) for x in vars.vars["MIDIPITCH"]]
-                else:
-                    _tmp_hz = midiToHz(vars.vars["MIDIPITCH"])
-                self.pitch = Sig(_tmp_hz)
-            elif mode == 2:
-                if type(vars.vars["MIDIPITCH"]) is list:
-                    _tmp_tr = [midiToTranspo(x) for x in vars.vars["MIDIPITCH"]]
-                else:
-                    _tmp_tr = midiToTranspo(vars.vars["MIDIPITCH"])
-                self.pitch = Sig(_tmp_tr)
-            elif mode == 3:
-                self.pitch = Sig(vars.vars["MIDIPITCH"])
+            self.pitch = Sig(self.exportPitch(vars.vars["MIDIPITCH"]))
             self._firsttrig = Trig().play()
             self._secondtrig = Trig().play(delay=vars.vars["NOTEONDUR"])
             self._trigamp = Counter(Mix([self._firsttrig, self._secondtrig]), min=0, max=2, dir=1)
+            self._velocity = Sig(vars.vars["MIDIVELOCITY"])
             self._lfo_amp = LFOSynth(.5, self._trigamp, self._midi_metro)
-            self.graphAttAmp = GraphicalDelAdsr(loop=False, mul=self._rawamp*vars.vars["MIDIVELOCITY"], add=self._lfo_amp.sig()).stop()
-            self.graphRelAmp = GraphicalDelAdsr(loop=False, mul=self._rawamp*vars.vars["MIDIVELOCITY"], add=self._lfo_amp.sig()).stop()
+            self.graphAttAmp = GraphicalDelAdsr(loop=False, mul=self._rawamp*self._velocity,
+                                                add=self._lfo_amp.sig()).stop()
+            self.graphRelAmp = GraphicalDelAdsr(loop=False, mul=self._rawamp*self._velocity,
+                                                add=self._lfo_amp.sig()).stop()
             self.normamp = MidiDelAdsr(self._trigamp, delay=0, attack=.001, decay=.1, sustain=.5, release=1,
-                                       mul=self._rawamp*vars.vars["MIDIVELOCITY"], add=self._lfo_amp.sig())
+                                       mul=self._rawamp*self._velocity, add=self._lfo_amp.sig())
             self.amp = self.normamp + self.graphAttAmp + self.graphRelAmp
             self.trig = Trig().play()
 
@@ -726,6 +852,27 @@ class BaseSynth:
             else:
                 self._params[i1] = ParamTranspo(self, self._midi_metro)
 
+    def exportPitch(self, midipitch):
+        if self.scaling == 1:
+            func = midiToHz
+        elif self.scaling == 2:
+            func = midiToTranspo
+        else:
+            return midipitch
+        if type(midipitch) is list:
+            return [func(x) for x in midipitch]
+        return func(midipitch)
+
+    def retrig(self, midipitch, velocity=None):
+        # plays the next note of an export session with the same synth
+        self._note.value = midipitch
+        self.pitch.value = self.exportPitch(midipitch)
+        if velocity is not None:
+            self._velocity.value = velocity
+        self._firsttrig.play()
+        self._secondtrig.play(delay=vars.vars["NOTEONDUR"])
+        self.trig.play()
+
     def set(self, which, x):
         self._params[which].set(x)
 
@@ -1348,6 +1495,274 @@ class VoltageControlledOsc(BaseSynth):
         self.out = DCBlock(self.mix)
 
 
+class SamplePool:
+    """
+    The tables of the sound files loaded by the samplers, shared by all
+    samplers of the process. A table is kept as long as a sampler uses it,
+    a file is loaded again once it changed on disk.
+    """
+    def __init__(self):
+        self.tables = {}  # (path, mtime): [table, refcount]
+        self.loading = {}  # (path, mtime): event set once the table is created
+        self.lock = threading.Lock()
+
+    def getKey(self, path):
+        return os.path.realpath(path), os.path.getmtime(path)
+
+    def has(self, path):
+        return self.getKey(path) in self.tables
+
+    def acquire(self, path, load):
+        """
+        Returns the table of `path` and its pool key, `load(path)` creates the
+        table if it isn't shared yet. The file is decoded outside of the lock,
+        the other threads acquiring it meanwhile wait for the first one.
+        """
+        key = self.getKey(path)
+        while True:
+            with self.lock:
+                if key in self.tables:
+                    self.tables[key][1] += 1
+                    return self.tables[key][0], key
+                event = self.loading.get(key)
+                if event is None:
+                    event = self.loading[key] = threading.Event()
+                    break
+            event.wait()
+        try:
+            table = load(path)
+        except Exception:
+            # the waiting threads try it themselves
+            with self.lock:
+                del self.loading[key]
+            event.set()
+            raise
+        with self.lock:
+            self.tables[key] = [table, 1]
+            del self.loading[key]
+        event.set()
+        return table, key
+
+    def release(self, key):
+        with self.lock:
+            self.tables[key][1] -= 1
+            if self.tables[key][1] == 0:
+                del self.tables[key]
+
+
+SAMPLE_POOL = SamplePool()
+
+
+class SampleCache:
+    """
+    Loads the sound files of the Loopers of a sampler on demand. A Looper
+    plays an empty placeholder table until its file is loaded by the loader
+    thread, either after its first note or by prefetch(). Without the loader
+    thread (see start()), eg. in exports, a file is loaded on its first note.
+    The loaded tables fit into `budget` bytes (0 for no limit), the least
+    recently played ones are evicted first. `files` maps the keys to (path,
+    channels, frames), `onload(key)` is called once a file is loaded.
+    preload() decodes many files at once on a pool of threads (needs numpy).
+    The tables are shared with the other samplers through SAMPLE_POOL. With
+    the sampler disk cache turned on, the decoded files are stored in it and
+    read from it the next time.
+    """
+    def __init__(self, files, budget, onload=None):
+        self.files = files
+        self.budget = budget
+        self.onload = onload
+        self.itemsize = 8 if vars.vars["PYO_PRECISION"] == "double" else 4
+        self.placeholders = {channels: DataTable(size=2, chnls=channels)
+                             for channels in set(f[1] for f in files.values())}
+        self.sr = int(list(self.placeholders.values())[0].getSamplingRate()) if files else 0
+        self.diskcache = get_sample_cache()
+        self.loopers = {}
+        self.tables = collections.OrderedDict()  # the least recently used first
+        self.poolkeys = {}
+        self.size = 0
+        # the audio thread only waits for the bookkeeping, the files are decoded outside of the lock
+        self.lock = threading.RLock()
+        # (priority, order, key), the notes played before the prefetched files
+        self.queue = queue.PriorityQueue()
+        self.order = itertools.count()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def getLooper(self, key):
+        self.loopers[key] = Looper(table=self.placeholders[self.files[key][1]],
+                                   xfadeshape=0, startfromloop=True, autosmooth=True).stop()
+        return self.loopers[key]
+
+    def getSize(self, key):
+        path, channels, frames = self.files[key]
+        return (frames + 1) * channels * self.itemsize
+
+    def isLoaded(self, key):
+        return key in self.tables
+
+    def start(self):
+        "Starts the loader thread, the files of the notes are then loaded in the background."
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def play(self, key):
+        """
+        Marks the file of `key` as the most recently used. A file not loaded
+        yet is queued for the loader thread, its Looper plays the placeholder
+        until then. Called by the audio thread, it never decodes a file there
+        while the loader thread runs.
+        """
+        with self.lock:
+            if key in self.tables:
+                self.tables.move_to_end(key)
+                return
+        if self.thread is None:
+            self.load(key)
+        else:
+            self.queue.put((0, next(self.order), key))
+
+    def load(self, key):
+        "Loads the file of `key` into its Looper if needed and marks it as the most recently used."
+        with self.lock:
+            if key in self.tables:
+                self.tables.move_to_end(key)
+                return
+        if self.diskcache is None:
+            self.setTable(key, SndTable)
+        else:
+            self.setTable(key, lambda path: self.getDataTable(self.readSamples(key)))
+
+    def setTable(self, key, load):
+        """
+        Gets the table of `key` from the pool, created by `load(path)` outside
+        of the lock, and gives it to its Looper.
+        """
+        table, poolkey = SAMPLE_POOL.acquire(self.files[key][0], load)
+        with self.lock:
+            if key in self.tables or self.stopped.is_set():
+                # loaded meanwhile by another thread, or the sampler is closed
+                SAMPLE_POOL.release(poolkey)
+                return
+            self.evict(self.getSize(key), key)
+            self.tables[key] = table
+            self.poolkeys[key] = poolkey
+            self.size += self.getSize(key)
+            self.loopers[key].table = table
+        if self.onload is not None:
+            self.onload(key)
+
+    def touch(self, key):
+        with self.lock:
+            if key in self.tables:
+                self.tables.move_to_end(key)
+
+    def evict(self, size, keep):
+        # playing Loopers keep their tables, the budget may then be exceeded
+        if self.budget <= 0:
+            return
+        for key in list(self.tables.keys()):
+            if self.size + size <= self.budget:
+                break
+            if key != keep and not self.loopers[key].isPlaying():
+                self.unload(key)
+
+    def unload(self, key):
+        self.loopers[key].table = self.placeholders[self.files[key][1]]
+        del self.tables[key]
+        self.size -= self.getSize(key)
+        SAMPLE_POOL.release(self.poolkeys.pop(key))
+
+    def prefetch(self, keys):
+        "Queues the files of `keys` in this order for the loader thread, as many as fit the budget."
+        for key in keys:
+            self.queue.put((1, next(self.order), key))
+
+    def run(self):
+        prefetching = True
+        while True:
+            priority, order, key = self.queue.get()
+            if key is None:
+                break
+            if priority == 1:
+                if not prefetching:
+                    continue
+                with self.lock:
+                    size = self.size + self.getSize(key)
+                    if self.budget > 0 and key not in self.tables and size > self.budget:
+                        # the files played later are loaded on their notes
+                        prefetching = False
+                        continue
+            try:
+                self.load(key)
+            except Exception as e:
+                print(f'The sampler can\'t load "{self.files[key][0]}": {e}')
+            if self.queue.empty():
+                self.saveDiskCache()
+
+    def preload(self, keys, progress=None):
+        """
+        Decodes the files of `keys` in parallel, as many as fit into the budget
+        in this order, and loads them. `progress(count, total)` is called after
+        each loaded file.
+        """
+        size = 0
+        for i, key in enumerate(keys):
+            size += self.getSize(key)
+            if self.budget > 0 and size > self.budget:
+                keys = keys[:i]
+                break
+        # the files already loaded by another sampler are shared, not decoded again
+        shared = [key for key in keys if SAMPLE_POOL.has(self.files[key][0])]
+        for key in shared:
+            self.load(key)
+        decoded = [key for key in keys if key not in shared]
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            # the decoding and resampling release the GIL, the tables are filled in order
+            results = executor.map(lambda k: (k, self.readSamples(k)), decoded)
+            for count, (key, samples) in enumerate(results, len(shared) + 1):
+                self.setTable(key, lambda path: self.getDataTable(samples))
+                if progress is not None:
+                    progress(count, len(keys))
+        self.saveDiskCache()
+
+    def getDataTable(self, samples):
+        table = DataTable(size=max(len(samples), 2), chnls=samples.shape[1])
+        for chnl in range(samples.shape[1]):
+            numpy.asarray(table.getBuffer(chnl))[:len(samples)] = samples[:, chnl]
+        return table
+
+    def readSamples(self, key):
+        "Returns the samples of `key` at the server's sampling rate, from the disk cache if it can."
+        path = self.files[key][0]
+        dtype = numpy.float64 if self.itemsize == 8 else numpy.float32
+        if self.diskcache is not None:
+            cachekey = self.diskcache.getKey(path, self.sr, dtype)
+            samples = self.diskcache.load(cachekey)
+            if samples is not None:
+                return samples
+        header, data = read_frames(path)
+        samples = resample(decode(header, data), header["sr"], self.sr).astype(dtype)
+        if self.diskcache is not None:
+            self.diskcache.store(cachekey, samples)
+        return samples
+
+    def saveDiskCache(self):
+        if self.diskcache is not None:
+            self.diskcache.save()
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            # before the queued files
+            self.queue.put((-1, 0, None))
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            for key in list(self.tables.keys()):
+                self.unload(key)
+        self.saveDiskCache()
+
+
 class ZB_Sampler(BaseSynth):
     """
     Sampler and Looper.
@@ -1368,6 +1783,22 @@ class ZB_Sampler(BaseSynth):
         Pitch : 1.0 saved pitch, 2.0 one octave higher, 0.5 one octave lower
         X-Fade (%) : if in loop mode percetage of cross-fading time the loop
 
+    Sound files with loop points (eg. exported with 'Find loop points') play
+    their attack once and then loop over their loop points in loop mode, as
+    long as Loop Start Time and Loop Duration are 0.
+
+    Sound files larger than the preference 'Stream sampler files above MB'
+    are streamed from disk instead of being loaded into memory: only their
+    head is kept, the rest is read by a background thread into a ring buffer
+    per voice. The loop points of a streamed note are those at its start.
+
+    The other files are decoded on their first note or by a background
+    prefetch of the module's key range, within the preference 'Sampler memory
+    per module in MB'. The least recently played files are unloaded first.
+    With the preference 'Sampler folder loading' set to Full, the folder is
+    decoded at once by a pool of threads instead. Samplers playing the same
+    files share their tables.
+
     ____________________________________________________________________________
     Author : Hans-Jörg Bibiko - 2022
     ____________________________________________________________________________
@@ -1376,6 +1807,10 @@ class ZB_Sampler(BaseSynth):
         BaseSynth.__init__(self, config, mode=3)
         self.isSampler = True
         self.loops = {}
+        self.fileloops = {}
+        self.streams = {}
+        self.streamer = None
+        self.cache = None
         self.path = ""
 
         self.loopmode = 0
@@ -1387,7 +1822,17 @@ class ZB_Sampler(BaseSynth):
 
     def stoploop(self, voice):
         pit = int(self.pitch.get(all=True)[voice])
-        if pit in self.loops:
+        if pit in self.streams:
+            self.streamer.release(voice, self.normamp.release)
+            player = self.streamplayers[voice]
+            player.stop()
+            if self.streamphases[voice] is not None:
+                self.streamphases[voice].stop()
+            if isinstance(player.mul, MidiDelAdsr):
+                player.mul.setInput([Sig(0.)] * 2, 0.)
+        elif pit in self.loops:
+            if self.cache is not None:
+                self.cache.touch(pit)
             self.loops[pit].stop()
             if isinstance(self.loops[pit].mul, MidiDelAdsr):
                 self.loops[pit].mul.setInput([Sig(0.)] * 2, 0.)
@@ -1398,43 +1843,86 @@ class ZB_Sampler(BaseSynth):
         if vel == 0.:
             self.stoploop(voice)
             return
-        if pit in self.loops:
+        if pit in self.streams:
+            self.playstream(voice, pit, vel)
+        elif pit in self.loops:
             o = self.loops[pit]
+            if self.cache is not None and pit in self.cache.files:
+                self.cache.play(pit)
             o.reset()
-            o.start = o.table.getDur() * self.starttime
-            if self.duration == 0:
-                o.dur = o.table.getDur()
-            else:
-                o.dur = o.table.getDur() * self.duration
+            self.setLoopPoints(pit, o)
             if self.loopmode == 0:
                 o.xfade = [0, 0]
             else:
                 o.xfade = [self.xfade] * 2
             o.mode = self.loopmode
             o.pitch = [self.samplerpitch] * 2
-            if isinstance(o.mul, MidiDelAdsr):
-                o.mul.stop()
-                o.mul = 1.
-            env = MidiDelAdsr([Sig(vel)] * 2, delay=self.normamp.delay, attack=self.normamp.attack, decay=self.normamp.decay,
-                           sustain=self.normamp.sustain, release=self.normamp.release, mul=self._rawamp * 0.5,
-                           add=[self._lfo_amp.sig()] * 2)
-            env.setExp(self.normamp.exp)
-            o.mul = env
+            self.setNoteEnv(o, vel)
             o.play(delay=self.normamp.delay)
             o.setStopDelay(self.normamp.release + .001)
 
+    def playstream(self, voice, key, vel):
+        sfile = self.streams[key]
+        start, end, fromloop = self.getStreamLoopPoints(key)
+        xfade = self.xfade if self.loopmode > 0 else 0
+        # a new phase per note, the reader thread follows it from 0
+        phase = Phasor(freq=self.samplerpitch * sfile.sr / samplestream.STREAM_RING,
+                       mul=samplestream.STREAM_RING / (samplestream.STREAM_RING + 1.)).stop()
+        streamvoice = samplestream.StreamVoice(sfile, self.loopmode, start, end, xfade, fromloop)
+        self.streamer.start(voice, streamvoice, phase.get)
+        player = self.streamplayers[voice]
+        player.index = phase
+        self.streamphases[voice] = phase
+        self.setNoteEnv(player, vel)
+        phase.play(delay=self.normamp.delay)
+        player.play(delay=self.normamp.delay)
+        player.setStopDelay(self.normamp.release + .001)
+        phase.setStopDelay(self.normamp.release + .001)
+
+    def setNoteEnv(self, o, vel):
+        if isinstance(o.mul, MidiDelAdsr):
+            o.mul.stop()
+            o.mul = 1.
+        env = MidiDelAdsr([Sig(vel)] * 2, delay=self.normamp.delay, attack=self.normamp.attack,
+                          decay=self.normamp.decay, sustain=self.normamp.sustain,
+                          release=self.normamp.release, mul=self._rawamp * 0.5,
+                          add=[self._lfo_amp.sig()] * 2)
+        env.setExp(self.normamp.exp)
+        o.mul = env
+
+    def setLoopPoints(self, key, o):
+        if key in self.fileloops and self.starttime == 0 and self.duration == 0:
+            # the loop points of the sound file, after its attack
+            o.start, o.dur = self.fileloops[key]
+            o.startfromloop = False
+            return
+        o.start = o.table.getDur() * self.starttime
+        if self.duration == 0:
+            o.dur = o.table.getDur()
+        else:
+            o.dur = o.table.getDur() * self.duration
+        o.startfromloop = True
+
+    def getStreamLoopPoints(self, key):
+        "Returns the loop start and end frames of a streamed file and whether it starts there."
+        sfile = self.streams[key]
+        if sfile.header.get("loops") and self.starttime == 0 and self.duration == 0:
+            start, end = sfile.header["loops"][0]
+            return start, end, False
+        start = int(sfile.frames * self.starttime)
+        if self.duration == 0:
+            return start, sfile.frames, True
+        return start, min(sfile.frames, start + int(sfile.frames * self.duration)), True
+
     def set(self, which, x):
         if which == 1:
             self.starttime = x
-            for o in self.loops.values():
-                o.start = o.table.getDur() * x
+            for key, o in self.loops.items():
+                self.setLoopPoints(key, o)
         elif which == 2:
             self.duration = x
-            for o in self.loops.values():
-                if x > 0:
-                    o.dur = o.table.getDur() * x
-                else:
-                    o.dur = o.table.getDur()
+            for key, o in self.loops.items():
+                self.setLoopPoints(key, o)
         elif which == 3:
             self.samplerpitch = x + self.p3
 
@@ -1459,13 +1947,30 @@ class ZB_Sampler(BaseSynth):
                 o.xfade = 0.
                 self.xfade = 0.
 
-    def loadSamples(self, foldername):
-
+    def loadSamples(self, foldername, progress=None):
+        """
+        Assigns the sound files of `foldername`. With the preference 'Sampler
+        folder loading' set to Full, they are all decoded at once and
+        `progress(count, total)` is called after each file.
+        """
         if not os.path.isdir(foldername):
             return False
 
         self.path = foldername
         self.loops = {}
+        self.fileloops = {}
+        self.streams = {}
+        self.closeStreamer()
+        self.closeCache()
+
+        files = {}
+        streamsize = vars.vars["SAMPLER_STREAM_SIZE"] * 1024 * 1024
+        if vars.vars["MIDIPITCH"] is not None:
+            # exports render faster than real time, the reader thread couldn't follow them
+            streamsize = 0
+        elif streamsize > 0 and samplestream.numpy is None:
+            print("Streaming the sampler files needs numpy.")
+            streamsize = 0
 
         for f in [f for f in os.listdir(self.path) if f[-4:].lower() in [".wav", ".aif"]]:
             try:
@@ -1473,22 +1978,91 @@ class ZB_Sampler(BaseSynth):
             except Exception:
                 continue
             if key_index >= 0 and key_index < 128:
-                self.loops[key_index] = Looper(table=SndTable(os.path.join(self.path, f)),
-                                               xfadeshape=0, startfromloop=True, autosmooth=True).stop()
+                path = os.path.join(self.path, f)
+                if streamsize > 0 and os.path.getsize(path) > streamsize:
+                    try:
+                        self.streams[key_index] = samplestream.StreamFile(path)
+                        continue
+                    except Exception as e:
+                        # loaded like the smaller files, by pyo if need be
+                        print(f'The sampler can\'t stream "{path}": {e}')
+                try:
+                    header = read_header(path)
+                except Exception:
+                    # pyo may still read it, load it right away
+                    self.loops[key_index] = Looper(table=SndTable(path), xfadeshape=0,
+                                                   startfromloop=True, autosmooth=True).stop()
+                    continue
+                frames = header["size"] // get_frame_size(header)
+                files[key_index] = (path, header["channels"], frames)
+                if header.get("loops"):
+                    start, end = header["loops"][0]
+                    self.fileloops[key_index] = (start / header["sr"], (end - start) / header["sr"])
+
+        if files:
+            # the files are only decoded when played or prefetched, the folder is assigned at once
+            self.cache = SampleCache(files, vars.vars["SAMPLER_CACHE_SIZE"] * 1024 * 1024,
+                                     lambda key: self.setLoopPoints(key, self.loops[key]))
+            for key in files:
+                self.loops[key] = self.cache.getLooper(key)
+            preload = vars.vars["SAMPLER_PRELOAD"] == "Full"
+            if preload and numpy is None:
+                print("Preloading the sampler folders needs numpy.")
+                preload = False
+            if vars.vars["MIDIPITCH"] is None:
+                # exports load the files on their notes, live notes don't wait for them
+                keys = self.getPrefetchOrder(files.keys())
+                if preload:
+                    self.cache.preload(keys, progress)
+                else:
+                    self.cache.prefetch(keys)
+                self.cache.start()
 
-        if len(self.loops.keys()) == 0:
+        if len(self.loops.keys()) == 0 and len(self.streams.keys()) == 0:
             return False
 
         self.ton = TrigFunc(Change(self._trigamp), self.playloop, arg=list(range(vars.vars["POLY"])))
 
-        self.out = Mix([o for o in self.loops.values()], voices=2,
+        players = [o for o in self.loops.values()]
+        if self.streams:
+            # a ring buffer per voice, its last frame repeats the first one for the
+            # interpolation of Pointer
+            self.streamtables = [DataTable(size=samplestream.STREAM_RING + 1, chnls=2)
+                                 for i in range(vars.vars["POLY"])]
+            self.streamphases = [None] * vars.vars["POLY"]
+            self.streamplayers = [Pointer(table, index=Sig(0)).stop()
+                                  for table in self.streamtables]
+            self.streamer = samplestream.SampleStreamer([[table.getBuffer(i) for i in range(2)]
+                                                         for table in self.streamtables])
+            players += self.streamplayers
+
+        self.out = Mix(players, voices=2,
                        mul=[Sig(self._panner.amp_L), Sig(self._panner.amp_R)]).out()
 
         return True
 
+    def getPrefetchOrder(self, keys):
+        "The keys of the module's range first, from its middle outwards, then the nearest others."
+        middle = (self.first + self.last) / 2.
+        return sorted(keys, key=lambda k: (not self.first <= k <= self.last, abs(k - middle)))
+
+    def closeCache(self):
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    def closeStreamer(self):
+        if self.streamer is not None:
+            self.streamer.close()
+            self.streamer = None
+
     def __del__(self):
+        if hasattr(self, 'streamer'):
+            self.closeStreamer()
+        if hasattr(self, 'cache'):
+            self.closeCache()
         if hasattr(self, 'loops'):
-            for o in self.loops.values():
+            for o in list(self.loops.values()) + getattr(self, 'streamplayers', []):
                 if isinstance(o.mul, MidiDelAdsr):
                     o.mul.stop()
                     o.mul = 1.
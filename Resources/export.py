@@ -0,0 +1,1201 @@
+"""
+Copyright 2009-2015 Olivier Belanger - modifications by Hans-Jörg Bibiko 2022
+
+Rendering of sample banks from a synth description (the dictionary written
+in .zy files) without any wx widget. Used by the Export menu of Zyne_B and
+by the ZyneRender.py command line tool.
+"""
+import functools
+import json
+import math
+import multiprocessing
+import os
+import pickle
+import re
+import threading
+import time
+import Resources.variables as vars
+from Resources.audio import *
+from Resources.modules import get_module_dict
+import Resources.exportworker as exportworker
+from Resources.exportcache import get_settings_key
+from Resources.exportanalysis import LOOP_MATCH_FRAMES, analyze_data, analyze_file, apply_gain, \
+    decode, fade_out, fade_samples, find_end, find_loop, from_buffers, quantize, resample, \
+    write_manifest
+import Resources.exportanalysis as exportanalysis
+from Resources.exportjournal import ExportJournal
+from Resources.exportpipeline import ExportPipeline
+from Resources.soundfiles import get_frame_size, read_frames, split_channels, write_soundfile
+
+
+EXPORT_MODES = ["Samples", "Chords", "Tracks", "ChordsTracks"]
+SAMPLING_RATES = [44100, 48000, 96000]
+SAMPLE_TYPES = [16, 24, 32]
+FILE_FORMATS = ["wav", "aif"]
+NORMALIZE_TARGETS = {"peak": -1., "lufs": -16.}
+POSTPROC_THREADS = 2
+LOOP_TAIL = 0.01  # seconds kept after the loop of a cut file, for the interpolation of samplers
+DRAFT_SAMPLING_RATE = 22050
+
+
+def load_patch(filename):
+    try:
+        with open(filename, "r") as json_file:
+            dic = json.load(json_file)
+    except Exception:
+        # try to read original zy file notation via eval
+        with open(filename, "r") as f:
+            dic = eval(f.read())
+    if len(dic["modules"]) and len(dic["modules"][0]) == 2:  # update old set
+        dic["modules"] = [list(m) + [0, 1, 127, 0, 127, 0, 0, 0, "", 0] for m in dic["modules"]]
+    return dic
+
+
+def get_export_root():
+    if vars.vars["EXPORT_PATH"] and os.path.isdir(vars.vars["EXPORT_PATH"]):
+        return vars.vars["EXPORT_PATH"]
+    rootpath = os.path.join(os.path.expanduser("~"), "Desktop", "zyne_export")
+    if not os.path.isdir(rootpath):
+        os.makedirs(rootpath)
+    return rootpath
+
+
+def parse_chords(text):
+    notes = []
+    try:
+        for c in text.split(','):
+            s = c.split('/')
+            if len(s) == 1:
+                s.append(100)
+            notes.append((int(s[0]), abs(int(s[1]))))
+    except ValueError:
+        raise ValueError("The chords may only contain positive and negative integers separated "
+                         "by a comma or a slash.") from None
+    pitch_factors = [n[0] for n in notes]
+    amp_factors_ = [n / 127 for n in [127 if n[1] > 127 else n[1] for n in notes]]
+    m_amp = sum(amp_factors_)
+    if m_amp == 0:
+        raise ValueError("At least one note of the chords needs a velocity.")
+    amp_factors = [a / m_amp for a in amp_factors_]
+    return pitch_factors, amp_factors
+
+
+def parse_velocities(velocity):
+    "Returns the list of MIDI velocities of a velocity or of a comma separated list of velocities."
+    if not isinstance(velocity, (list, tuple)):
+        velocity = str(velocity).split(',')
+    try:
+        return [abs(int(v)) for v in velocity]
+    except ValueError:
+        raise ValueError("The velocity may only contain positive integers between 1 and 127 "
+                         "separated by a comma.") from None
+
+
+def parse_formats(formats):
+    """
+    Returns the list of (fileformat, sampletype) pairs of a comma separated
+    list of formats, eg. "wav16,aif24", or of a list of such strings.
+    """
+    if isinstance(formats, str):
+        formats = formats.split(',')
+    result = []
+    for fmt in formats or []:
+        fmt = fmt.strip().lower()
+        if not fmt:
+            continue
+        match = re.match(r"(wav|aif)f?(16|24|32)$", fmt)
+        if match is None:
+            raise ValueError(f"Unknown export format '{fmt}'")
+        result.append((match.group(1), int(match.group(2))))
+    return result
+
+
+def get_bake_patch(patch, index):
+    """
+    Returns the patch rendering the module `index` of `patch` alone, for the
+    samples of a sampler taking its place. The envelope, amplitude and panning
+    of the module, and their LFOs, are left to the sampler: the module plays
+    over all keys and velocities with a flat envelope, at the level it has
+    live at full velocity and amplitude.
+    """
+    modparams = list(patch["modules"][index])
+    modparams[1:7] = [1, 0, 0, 127, 0, 127]
+    if len(modparams) == 13 and modparams[12] is not None:
+        modparams[12] = [0] + list(modparams[12][1:])
+    params = list(patch["params"][index])
+    if len(params) == 10:  # old zy
+        params = params[:5] + [1.] + params[5:]
+    params[:4] = [0., .001, params[2], 1.]
+    params[5:7] = [1., 1. / velocity_to_amp(127)]
+    params[10] = .5
+    lfos = [dict(lfo, state=0) if i in [0, 4] else lfo
+            for i, lfo in enumerate(patch["lfo_params"][index])]
+    return dict(patch, modules=[modparams], params=[params], lfo_params=[lfos],
+                ctl_params=[patch["ctl_params"][index]])
+
+
+def get_baked_module(patch, index, path, looped):
+    """
+    Returns the module settings, slider values, LFOs and MIDI controllers of
+    a sampler playing the samples of the folder `path` baked from the module
+    `index` of `patch`, with the envelope, amplitude and panning of the module.
+    With `looped`, the sampler loops over the loop points of the samples.
+    """
+    modparams = list(patch["modules"][index])
+    # the transposition of the module is in the samples
+    modparams[0] = "Sampler"
+    modparams[7:11] = [0, int(looped), 0, path]
+    dic = get_module_dict("Sampler")
+    params = list(patch["params"][index])
+    if len(params) == 10:  # old zy
+        params = params[:5] + [1.] + params[5:]
+    params[7:10] = [dic["p1"][1], dic["p2"][1], dic["p3"][1]]
+    lfos = [lfo if i in [0, 4] else dict(lfo, state=0)
+            for i, lfo in enumerate(patch["lfo_params"][index])]
+    ctls = list(patch["ctl_params"][index])
+    ctls[7:10] = [None] * len(ctls[7:10])
+    return modparams, params, lfos, ctls
+
+
+def velocity_to_amp(velocity):
+    velocity = abs(int(velocity))
+    if velocity > 127:
+        velocity = 1.
+    elif velocity < 1:
+        velocity = 1 / 127
+    else:
+        velocity /= 127
+    return velocity * .33
+
+
+class ExportJob:
+    """
+    Settings of one export: which notes to render, how and where.
+
+    Notes:
+    `mode` is Samples, Chords, Tracks (one file per module) or ChordsTracks.
+    `first`, `last` and `step` give the range of MIDI notes, `last` excluded.
+    `velocity` is a velocity or a list of layers, eg. "32,64,96,127".
+    `chords` holds 'relative note/velocity' pairs, eg. "+4/120,-1/40,12".
+    `noteon` and `release` are the durations in seconds of each note.
+    `seed` overrides the seed of the patch, 0 randomizes every export.
+
+    Files:
+    `filename` is the folder of the export in `rootpath`.
+    `extraformats` are written besides the export format, eg. "wav16,aif24".
+    `resume` only renders the files missing or changed since the journal.
+
+    Rendering:
+    `processes` render the files in parallel, each with its own server.
+    `session` plays the notes one after the other in a single server.
+    `batch` notes are rendered at once on separate output channels.
+    `stems` renders the modules of a note at once in the Tracks modes.
+    `draft` renders at 22050 Hz, with one voice stream per module.
+    `upsample` converts the draft files to the rate of the patch.
+
+    Post-processing:
+    `tailthresh` (dB) ends a note once it stayed below it for `tailhold` s.
+    `normalize` ("peak" or "lufs") gives all files the gain for `normtarget`.
+    `trimthresh` (dB) cuts the end of the files, faded over `fadeout` s.
+    `loop` writes the loop points found in the noteon for samplers.
+    `loopcut` also ends the files shortly after their loop.
+    """
+    def __init__(self, mode="Samples", filename="zyne", first=60, last=72, step=1,
+                 velocity=90, chords="+4/120,-1/40,12", noteon=1., release=1., rootpath=None,
+                 processes=1, session=False, tailthresh=None, tailhold=.05, batch=1, stems=False,
+                 normalize=None, normtarget=None, trimthresh=None, fadeout=0., resume=False,
+                 seed=None, extraformats=None, loop=False, loopcut=False, draft=False,
+                 upsample=False):
+        if mode not in EXPORT_MODES:
+            raise ValueError(f"Unknown export mode '{mode}'")
+        self.mode = mode
+        self.filename = filename
+        self.first = int(first)
+        self.last = int(last)
+        self.step = int(step)
+        self.noteon = float(noteon)
+        self.release = float(release)
+        self.rootpath = rootpath
+        self.processes = max(1, int(processes))
+        self.session = bool(session)
+        self.batch = max(1, int(batch))
+        self.stems = bool(stems) and mode in ["Tracks", "ChordsTracks"]
+        if self.session and (self.batch > 1 or self.stems):
+            raise ValueError("A session export renders one note at a time")
+        self.tailthresh = tailthresh
+        if tailthresh is not None:
+            self.tailthresh = float(tailthresh)
+        self.tailhold = float(tailhold)
+        if normalize not in NORMALIZE_TARGETS and normalize is not None:
+            raise ValueError(f"Unknown normalization '{normalize}'")
+        self.normalize = normalize
+        self.normtarget = normtarget
+        if normalize is not None:
+            if normtarget is None:
+                normtarget = NORMALIZE_TARGETS[normalize]
+            self.normtarget = float(normtarget)
+        self.trimthresh = trimthresh
+        if trimthresh is not None:
+            self.trimthresh = float(trimthresh)
+        self.fadeout = max(0., float(fadeout))
+        self.resume = bool(resume)
+        self.seed = seed
+        if seed is not None:
+            self.seed = abs(int(seed))
+        self.capture = exportanalysis.numpy is not None
+        self.extraformats = parse_formats(extraformats)
+        self.loopcut = bool(loopcut)
+        self.loop = bool(loop) or self.loopcut
+        self.draft = bool(draft)
+        self.upsample = bool(upsample) and self.draft
+        self.fileformat = vars.vars["FORMAT"]
+        self.sampletype = vars.vars["BITS"]
+        if mode in ["Chords", "ChordsTracks"]:
+            self.pitch_factors, self.amp_factors = parse_chords(chords)
+        else:
+            self.layers = parse_velocities(velocity)
+
+    def getDuration(self):
+        return self.noteon + self.release
+
+    def getServerAudio(self):
+        # the tail detection and the capture into tables process the server buffer by buffer
+        if self.tailthresh is not None or self.capture:
+            return "manual"
+        return "offline"
+
+    def getExportPath(self):
+        if self.rootpath is None:
+            self.rootpath = get_export_root()
+        return os.path.join(self.rootpath, self.filename)
+
+    def getHeader(self, sr, fileformat=None, sampletype=None):
+        """
+        Returns the sound file header (see soundfiles.read_header) of exported
+        files, by default in the export format.
+        """
+        if fileformat is None:
+            fileformat, sampletype = self.fileformat, self.sampletype
+        return {"fileformat": fileformat, "channels": 2, "sr": sr, "bits": sampletype,
+                "float": sampletype == 32}
+
+    def getExtraFormats(self):
+        """
+        Returns the formats written besides the export format. They are
+        converted from captured samples only.
+        """
+        if not self.capture:
+            return []
+        formats = []
+        for fmt in self.extraformats:
+            if fmt != (self.fileformat, self.sampletype) and fmt not in formats:
+                formats.append(fmt)
+        return formats
+
+    def getFormatFolder(self, fileformat, sampletype):
+        return "%s%d" % (fileformat, sampletype)
+
+    def getOutputs(self, name):
+        """
+        Returns the files written for the task file `name` as (name, fileformat,
+        sampletype) tuples, relative to the export path: `name` itself, then one
+        file per extra format in the folder of the format.
+        """
+        outputs = [(name, self.fileformat, self.sampletype)]
+        base = os.path.splitext(name)[0]
+        for fileformat, sampletype in self.getExtraFormats():
+            path = os.path.join(self.getFormatFolder(fileformat, sampletype),
+                                "%s.%s" % (base, fileformat))
+            outputs.append((path, fileformat, sampletype))
+        return outputs
+
+    def getRecordOptions(self):
+        fileformat = {"wav": 0, "aif": 1}.get(self.fileformat, 0)
+        sampletype = {16: 0, 24: 1, 32: 3}.get(self.sampletype, 1)
+        return fileformat, sampletype
+
+    def getTasks(self, modules):
+        """
+        Returns the list of files to render. Each task is a dictionary holding the
+        file name, the midi note, the pitch and velocity given to the synths, the
+        MIDI velocity of its layer (None for chords) and the index of the soloed
+        module (or None to render the whole synth).
+        """
+        tasks = []
+        for i in range(self.first, self.last, self.step):
+            if self.mode in ["Samples", "Tracks"]:
+                layers = [(i, velocity_to_amp(layer), layer) for layer in self.layers]
+            else:
+                layers = [([i + fac for fac in self.pitch_factors], self.amp_factors, None)]
+            for pitch, velocity, layer in layers:
+                prefix = "%03d" % i
+                if len(layers) > 1:
+                    prefix += "_v%03d" % layer
+                task = {"note": i, "pitch": pitch, "velocity": velocity, "layer": layer,
+                        "track": None}
+                if self.mode in ["Samples", "Chords"]:
+                    name = "%s_%s.%s" % (prefix, self.filename, self.fileformat)
+                    tasks.append(dict(task, name=name))
+                else:
+                    for j, modparams in enumerate(modules):
+                        name = "%s_%s_track_%02d_%s.%s" % (prefix, self.filename, j, modparams[0],
+                                                           self.fileformat)
+                        tasks.append(dict(task, name=name, track=j))
+        return tasks
+
+
+class GdadsrTrigger:
+    """Starts the graphical DADSR envelopes on the note-on and note-off of an exported note."""
+    def __init__(self, synth, graphAttAmp, graphRelAmp):
+        self.graphAttAmp = graphAttAmp
+        self.graphRelAmp = graphRelAmp
+        voices = list(range(len(synth.pitch)))
+        self.gdadsron = TrigFunc(synth._firsttrig, self.triggerOn, arg=voices)
+        self.gdadsroff = TrigFunc(synth._secondtrig, self.triggerOff, arg=voices)
+
+    def triggerOn(self, voice):
+        self.graphAttAmp._base_objs[voice].play()
+        self.graphRelAmp._base_objs[voice].stop()
+
+    def triggerOff(self, voice):
+        self.graphAttAmp._base_objs[voice].stop()
+        self.graphRelAmp._base_objs[voice].play()
+
+
+class HeadlessModule:
+    """
+    A module of a synth without its GenericPanel. Applies the saved module, LFO
+    and slider settings to the synth in the same order as the Zyne_B window does.
+    """
+    def __init__(self, modparams, params, lfo_params, solo=False):
+        self.name = modparams[0]
+        dic = get_module_dict(self.name)
+        self.config = [dic["p1"], dic["p2"], dic["p3"]]
+        self.synth = dic["synth"](self.config)
+        self.triggers = []
+        self.mute = modparams[1]
+        self.setModuleParams(modparams)
+        self.setLFOParams(lfo_params)
+        params = list(params)
+        if solo and self.mute == 0:
+            # muted modules are saved with a silent amplitude
+            params[6] = 1.
+        self.setParams(params)
+
+    def hasLFO(self, which):
+        if which in [1, 2, 3] and self.config[which - 1][4]:
+            return False
+        return not (self.synth.isSampler and which in [1, 2])
+
+    def setModuleParams(self, modparams):
+        mute, channel, firstVel, lastVel, first, last, firstkey_pitch = modparams[1:8]
+        loopmode, xfade, samplerpath, keymode = modparams[8:12]
+        if mute == 0:
+            self.synth._lfo_amp.stop()
+        self.synth.SetFirstKeyPitch(firstkey_pitch)
+        if self.synth.isSampler:
+            self.synth.SetLoopmode(loopmode)
+            self.synth.SetXFade(xfade)
+            if len(samplerpath.strip()) > 0:
+                self.synth.loadSamples(samplerpath)
+
+        if len(modparams) == 13 and modparams[12] is not None:
+            self.setGdadsr(self.synth, modparams[12])
+
+    def setGdadsr(self, env, gdadsr):
+        envmode, graphAtt_pts, graphRel_pts, graphAtt_exp, graphRel_exp, \
+            graphAtt_dur, graphRel_dur, graphAtt_mode, graphRel_mode = gdadsr
+        env.graphAttAmp.SetList(graphAtt_pts)
+        env.graphRelAmp.SetList(graphRel_pts)
+        env.graphAttAmp.exp = graphAtt_exp
+        env.graphRelAmp.exp = graphRel_exp
+        env.graphAttAmp.setMode(graphAtt_mode)
+        env.graphRelAmp.setMode(graphRel_mode)
+        if envmode == 1:
+            env.normamp.stop()
+            self.triggers.append(GdadsrTrigger(self.synth, env.graphAttAmp, env.graphRelAmp))
+        return envmode
+
+    def setLFOParams(self, lfo_params):
+        for i, lfo_conf in enumerate(lfo_params):
+            if not self.hasLFO(i):
+                continue
+            params = lfo_conf["params"]
+            if len(params) == 10:  # old zy
+                params = params[:5] + [1.] + params[5:]
+            if i == 0:
+                # DADSR knobs of the amplitude LFO act on the module's envelope
+                lfo = self.synth._params[0]
+                lfo.setType(params[8])
+            else:
+                lfo = self.synth._params[i].lfo
+                lfo.normamp.delay = params[0]
+                lfo.normamp.attack = params[1]
+                lfo.normamp.decay = params[2]
+                lfo.normamp.sustain = params[3]
+                lfo.normamp.release = params[4]
+                lfo.normamp.exp = float(params[5])
+                lfo.setType(int(params[8]))
+            lfo.setAmp(params[6])
+            lfo.setSpeed(params[7])
+            lfo.setJitter(params[9])
+            lfo.setSharp(params[10])
+
+            envmode = 0
+            if i > 0 and lfo_conf.get("gdadsr", None) is not None:
+                envmode = self.setGdadsr(lfo, lfo_conf["gdadsr"])
+            if i == 0:
+                if lfo_conf["state"]:
+                    self.synth._lfo_amp.play()
+                else:
+                    self.synth._lfo_amp.stop()
+            else:
+                self.synth._params[i].start_lfo(lfo_conf["state"], envmode)
+
+    def setParams(self, params):
+        if len(params) == 10:  # old zy
+            params = params[:5] + [1.] + params[5:]
+        self.synth.normamp.delay = params[0]
+        self.synth.normamp.attack = params[1]
+        self.synth.normamp.decay = params[2]
+        self.synth.normamp.sustain = params[3]
+        self.synth.normamp.release = params[4]
+        self.synth.normamp.setExp(float(params[5]))
+        self.synth._rawamp.value = params[6]
+        for i, conf in enumerate(self.config):
+            if conf[0] == "Transposition":
+                self.synth._transpo.value = params[7 + i] + self.synth.firstkey_pitch
+            else:
+                self.synth.set(i + 1, params[7 + i])
+        self.synth._panner.set(params[10])
+
+    def delete(self):
+        self.triggers = []
+        self.synth.__del__()
+
+
+class Exporter:
+    """
+    Renders the tasks of an ExportJob for a synth description `patch` with
+    the FSServer `fsserver`, booted with the audio driver given by
+    job.getServerAudio(). A new server is created if None.
+    Files found in the ExportCache `cache` are copied instead of rendered.
+    The rendered files are post-processed by an ExportPipeline while the next
+    ones render. The analysis of the exported files is written in a manifest
+    next to them. The finished files are written in an ExportJournal, so that
+    an interrupted export can be resumed.
+    """
+    def __init__(self, patch, job, fsserver=None, cache=None):
+        self.patch = patch
+        self.job = job
+        self.fsserver = fsserver
+        self.cache = cache
+        self.modules = []
+        self.voices = []
+        self.sessionNotes = 0
+        self.tasks = job.getTasks(patch["modules"])
+        self.poly = 1
+        self.seed = patch.get("seed", 0) if job.seed is None else job.seed
+        self.rendered = 0
+        self.cached = 0
+        self.resumed = 0
+        self.cancelled = False
+        self.normgain = None
+        self.elapsed = 0.
+        self.pipeline = None
+        self.journal = None
+        self.cacheLock = threading.Lock()
+
+    def setup(self):
+        keys = ["MIDIPITCH", "MIDIVELOCITY", "NOTEONDUR", "POLY", "SLIDERPORT"]
+        self.saved_vars = {key: vars.vars[key] for key in keys}
+        serverSettings = self.patch["server"]
+        vars.vars["SLIDERPORT"] = 0.001
+        vars.vars["POLY"] = serverSettings[1] + 1
+        self.poly = vars.vars["POLY"]
+        if self.job.draft:
+            # the voice streams playing the same note are rendered once and scaled,
+            # see getDraftNote()
+            vars.vars["POLY"] = 1
+        vars.vars["NOTEONDUR"] = self.job.noteon
+        if self.fsserver is None:
+            self.fsserver = FSServer(audio=self.job.getServerAudio())
+        sr = DRAFT_SAMPLING_RATE if self.job.draft else SAMPLING_RATES[serverSettings[0]]
+        nchnls = 2 * self.getVoiceCount()
+        server = self.fsserver.server
+        if server.getSamplingRate() != sr or server.getNchnls() != nchnls:
+            self.fsserver.shutdown()
+            self.fsserver.setSamplingRate(sr)
+            self.fsserver.setNchnls(nchnls)
+            self.fsserver.boot()
+        self.fsserver.setAmp(p_mathpow(10.0, serverSettings[4] * 0.05))
+        # the equalizer gains glide to new values, the chains start with the gains of the patch
+        eq = self.patch["postproc"]["EQ"]
+        self.fsserver.deletePostProcChain()
+        self.fsserver.eqFreq = list(eq[1:4])
+        self.fsserver.eqGain = [p_mathpow(10.0, gain * 0.05) for gain in eq[4:8]]
+        self.fsserver.createPostProcChain()
+        self.pipeline = ExportPipeline(self.getStages(), threads=POSTPROC_THREADS)
+
+    def cleanup(self):
+        vars.vars.update(self.saved_vars)
+        if self.pipeline is not None:
+            try:
+                self.pipeline.join()
+            finally:
+                self.pipeline.shutdown()
+                self.pipeline = None
+
+    def getStages(self):
+        "Returns the post-processing stages of a rendered file, see ExportPipeline."
+        stages = [self.loadItem]
+        if self.job.upsample:
+            if exportanalysis.numpy is None:
+                print("Upsampling the draft files needs numpy.")
+            else:
+                stages.insert(0, self.resampleItem)
+        if self.job.trimthresh is not None or self.job.fadeout > 0 or self.job.loop:
+            if exportanalysis.numpy is None:
+                print("Trimming, fading out and looping the exported files need numpy.")
+            else:
+                if self.job.trimthresh is not None:
+                    stages.append(self.trimItem)
+                if self.job.fadeout > 0 and not self.job.loopcut:
+                    stages.append(self.fadeItem)
+                if self.job.loop:
+                    stages.append(self.loopItem)
+        stages.append(self.writeItem)
+        if self.job.getExtraFormats():
+            stages.append(self.writeFormatsItem)
+        elif self.job.extraformats and not self.job.capture:
+            print("Exporting several formats needs numpy.")
+        stages += [self.analyzeItem, self.cacheItem]
+        if self.journal is not None:
+            stages.append(self.journalItem)
+        return stages
+
+    def loadItem(self, item):
+        if item["samples"] is not None:
+            # captured samples are converted to the export format here, not by the rendering thread
+            item["data"] = quantize(item["header"], item["samples"]).tobytes()
+        elif item["data"] is None:
+            # the file was just written, it is still in the disk cache
+            item["header"], item["data"] = read_frames(item["path"])
+        return item
+
+    def resampleItem(self, item):
+        if item["samples"] is None:
+            if item["data"] is None:
+                item["header"], item["data"] = read_frames(item["path"])
+            item["samples"] = decode(item["header"], item["data"])
+        sr = SAMPLING_RATES[self.patch["server"][0]]
+        item["samples"] = resample(item["samples"], item["header"]["sr"], sr)
+        item["header"] = dict(item["header"], sr=sr)
+        item["changed"] = True
+        return item
+
+    def trimItem(self, item):
+        # a silent file is kept as is
+        size = find_end(item["header"], item["data"], p_mathpow(10.0, self.job.trimthresh * 0.05))
+        size *= get_frame_size(item["header"])
+        if 0 < size < len(item["data"]):
+            item["data"] = item["data"][:size]
+            item["changed"] = True
+        return item
+
+    def fadeItem(self, item):
+        length = int(self.job.fadeout * item["header"]["sr"])
+        item["data"] = fade_out(item["header"], item["data"], length)
+        item["changed"] = True
+        return item
+
+    def loopItem(self, item):
+        header = item["header"]
+        sr = header["sr"]
+        end = int(self.job.noteon * sr)
+        loop = find_loop(decode(header, item["data"]), sr, end // 2, end)
+        if loop is None:
+            return item
+        item["header"] = dict(header, loops=[loop], note=item["task"]["note"])
+        if self.job.loopcut:
+            size = (loop[1] + max(LOOP_MATCH_FRAMES, int(LOOP_TAIL * sr))) * get_frame_size(header)
+            item["data"] = item["data"][:size]
+        item["changed"] = True
+        return item
+
+    def writeItem(self, item):
+        if item["changed"]:
+            write_soundfile(item["path"], item["header"], item["data"])
+        return item
+
+    def writeFormatsItem(self, item):
+        # the other formats are converted from the captured samples, cut and faded out like the file
+        frames = len(item["data"]) // get_frame_size(item["header"])
+        samples = item["samples"][:frames]
+        if self.job.fadeout > 0 and not self.job.loopcut:
+            samples = fade_samples(samples, int(self.job.fadeout * item["header"]["sr"]))
+        for name, fileformat, sampletype in self.job.getOutputs(item["task"]["name"])[1:]:
+            header = self.job.getHeader(item["header"]["sr"], fileformat, sampletype)
+            if "loops" in item["header"]:
+                header.update(loops=item["header"]["loops"], note=item["header"]["note"])
+            write_soundfile(os.path.join(self.job.getExportPath(), name), header,
+                            quantize(header, samples).tobytes())
+        return item
+
+    def analyzeItem(self, item):
+        item["task"]["analysis"] = analyze_data(item["header"], item["data"])
+        if "loops" in item["header"]:
+            loopstart, loopend = item["header"]["loops"][0]
+            item["task"]["analysis"].update(loopstart=loopstart, loopend=loopend)
+        return item
+
+    def cacheItem(self, item):
+        with self.cacheLock:
+            self.storeInCache(item["task"])
+        # the samples are not needed anymore
+        item["data"] = item["samples"] = None
+        return item
+
+    def journalItem(self, item):
+        self.addToJournal(item["task"])
+        return item
+
+    def postProcess(self, task, header=None, data=None, samples=None):
+        """
+        Sends a rendered file to the post-processing stages. `header` and `data`
+        are the samples of a file not written yet, or `samples` the float array
+        captured for it. Otherwise the file is read.
+        """
+        path = os.path.join(self.job.getExportPath(), task["name"])
+        changed = data is not None or samples is not None
+        self.pipeline.submit({"task": task, "path": path, "header": header, "data": data,
+                              "samples": samples, "changed": changed})
+
+    def getStreamCounts(self, count):
+        "Returns for each of the `count` notes of a chord the number of voice streams playing it."
+        return [len(range(i, max(count, self.poly), count)) for i in range(count)]
+
+    def getDraftNote(self, task):
+        """
+        Returns the pitch, velocity and output gain of `task` in a draft export.
+        A note plays on one voice stream scaled by the POLY streams of the full
+        rendering. The notes of a chord keep their numbers of streams, divided
+        by their common factor, which becomes the gain.
+        """
+        if type(task["pitch"]) is not list:
+            return task["pitch"], task["velocity"], self.poly
+        counts = self.getStreamCounts(len(task["pitch"]))
+        gain = functools.reduce(math.gcd, counts)
+        pitch = [p for p, count in zip(task["pitch"], counts) for k in range(count // gain)]
+        velocity = task["velocity"]
+        if type(velocity) is list:
+            velocity = [v for v, count in zip(velocity, counts) for k in range(count // gain)]
+        return pitch, velocity, gain
+
+    def finishPostProcessing(self):
+        self.pipeline.join()
+
+    def getVoiceCount(self):
+        "Returns the number of files rendered at once by one server."
+        if self.job.stems:
+            return self.job.batch * len(self.patch["modules"])
+        return self.job.batch
+
+    def createModules(self, track=None):
+        modules = []
+        for j, modparams in enumerate(self.patch["modules"]):
+            if track is not None and j != track:
+                continue
+            modules.append(HeadlessModule(modparams, self.patch["params"][j],
+                                          self.patch["lfo_params"][j], solo=track is not None))
+        self.modules.extend(modules)
+        return modules
+
+    def deleteModules(self):
+        for mod in self.modules:
+            mod.delete()
+        self.modules = []
+        self.fsserver.setModulesOutput([])
+
+    def render(self, task):
+        self.startSession([task])
+        self.renderNote(task)
+        self.stopSession()
+
+    def startSession(self, tasks):
+        """
+        Builds the modules of each task. The modules of the n-th task are sent
+        to their own post-processing chain on the output channels 2n and 2n+1.
+        With a seed, every task gets the same random values.
+        """
+        if self.seed:
+            # pyo seeds its random objects from a count of the objects created since the
+            # server booted
+            self.fsserver.shutdown()
+            self.fsserver.boot()
+        for k, task in enumerate(tasks):
+            pitch, velocity, gain = task["pitch"], task["velocity"], 1
+            if self.job.draft:
+                pitch, velocity, gain = self.getDraftNote(task)
+            vars.vars["MIDIPITCH"] = pitch
+            vars.vars["MIDIVELOCITY"] = velocity
+            if k == 0:
+                chain = self.fsserver.chain
+            else:
+                first = self.voices[0]["chain"]
+                chain = PostProcChain(2 * k, first.eqFreq, first.eqGain)
+            if self.seed:
+                self.fsserver.setRandomSeed(self.seed)
+            modules = self.createModules(task["track"])
+            voice = {"modules": modules, "chain": chain, "meter": None, "capture": None,
+                     "gain": None}
+            if self.job.draft:
+                voice["gain"] = Sig(gain)
+                chain.setModulesOutput([mod.synth.out * voice["gain"] for mod in modules])
+            else:
+                chain.setModulesOutput([mod.synth.out for mod in modules])
+            chain.setPostProcSettings(self.patch["postproc"])
+            if self.job.tailthresh is not None:
+                voice["meter"] = PeakAmp(chain.getOutput())
+            if self.job.capture:
+                voice["capture"] = TableCapture(chain.getOutput(),
+                                                self.getRecordFrames() / self.getSamplingRate())
+            self.voices.append(voice)
+        self.sessionNotes = 0
+
+    def renderNote(self, task):
+        path = os.path.join(self.job.getExportPath(), task["name"])
+        if self.sessionNotes > 0:
+            pitch, velocity = task["pitch"], task["velocity"]
+            if self.job.draft:
+                pitch, velocity, self.voices[0]["gain"].value = self.getDraftNote(task)
+            for mod in self.modules:
+                mod.synth.retrig(pitch, velocity)
+        if self.job.capture:
+            length = self.record()[0]
+            header = self.job.getHeader(self.getSamplingRate())
+            self.postProcess(task, header, samples=self.getCapturedSamples(0, length))
+        else:
+            fileformat, sampletype = self.job.getRecordOptions()
+            self.record(path, fileformat, sampletype)
+            self.postProcess(task)
+        self.sessionNotes += 1
+
+    def renderChannels(self, tasks):
+        if self.job.capture:
+            self.startSession(tasks)
+            try:
+                lengths = self.record()
+                header = self.job.getHeader(self.getSamplingRate())
+                for k, task in enumerate(tasks):
+                    self.postProcess(task, header, samples=self.getCapturedSamples(k, lengths[k]))
+            finally:
+                self.stopSession()
+            return
+        path = os.path.join(self.job.getExportPath(),
+                            ".%s.channels.%s" % (tasks[0]["name"], self.job.fileformat))
+        self.startSession(tasks)
+        try:
+            # recorded in the export format, the channels are split without converting the samples
+            fileformat, sampletype = self.job.getRecordOptions()
+            lengths = self.record(path, fileformat, sampletype)
+            header, data = read_frames(path)
+            for k, task in enumerate(tasks):
+                self.postProcess(task, dict(header, channels=2),
+                                 split_channels(header, data, 2 * k, 2, lengths[k]))
+        finally:
+            self.stopSession()
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def getSamplingRate(self):
+        return int(self.fsserver.server.getSamplingRate())
+
+    def getRecordFrames(self):
+        "Returns the number of frames rendered for a note, rounded up to whole buffers."
+        buffersize = self.fsserver.server.getBufferSize()
+        buffers = math.ceil(self.job.getDuration() * self.getSamplingRate() / buffersize)
+        return int(buffers) * buffersize
+
+    def getCapturedSamples(self, k, frames):
+        "Returns a copy of the first `frames` frames captured for the k-th voice."
+        capture = self.voices[k]["capture"]
+        return from_buffers(capture.getBuffers(), min(frames, capture.getSize()),
+                            self.fsserver.getAmp())
+
+    def record(self, path=None, fileformat=0, sampletype=0):
+        """
+        Renders the next job.getDuration() seconds, recorded in `path` or, without
+        a path, captured in the tables of the voices. Returns the length in
+        samples of each voice, shorter than the recording if its release tail
+        ended before the others.
+        """
+        server = self.fsserver.server
+        buffersize = server.getBufferSize()
+        buffers = self.getRecordFrames() // buffersize
+        if path is not None:
+            self.fsserver.recordOptions(self.job.getDuration(), path, fileformat, sampletype)
+        if self.job.getServerAudio() == "offline":
+            # an offline server returns from start() once the file is written and closed,
+            # the objects keep their state between two renderings
+            self.fsserver.start()
+            return [buffers * buffersize] * len(self.voices)
+        for voice in self.voices:
+            if voice["capture"] is not None:
+                voice["capture"].start()
+        # the manual server is processed buffer by buffer, with a tail threshold until
+        # the release tails stayed below it during the hold time
+        bufdur = buffersize / server.getSamplingRate()
+        noteon = int(math.ceil(self.job.noteon / bufdur))
+        hold = max(1, int(math.ceil(self.job.tailhold / bufdur)))
+        thresh = None
+        if self.job.tailthresh is not None:
+            thresh = p_mathpow(10.0, self.job.tailthresh * 0.05)
+        silent = [0] * len(self.voices)
+        ends = [buffers] * len(self.voices)
+        self.fsserver.start()
+        if path is not None:
+            self.fsserver.recstart()
+        for i in range(buffers):
+            self.fsserver.process()
+            if thresh is None:
+                continue
+            for k, voice in enumerate(self.voices):
+                if max(voice["meter"].get(all=True)) < thresh:
+                    silent[k] += 1
+                else:
+                    silent[k] = 0
+                if i >= noteon and silent[k] >= hold and ends[k] == buffers:
+                    ends[k] = i + 1
+            if i >= noteon and all(end <= i + 1 for end in ends):
+                break
+        if path is not None:
+            self.fsserver.recstop()
+        self.fsserver.stop()
+        return [end * buffersize for end in ends]
+
+    def stopSession(self):
+        self.voices = []
+        self.deleteModules()
+        self.fsserver.resetPostProcChain()
+
+    def getBatches(self, tasks=None):
+        """
+        Splits the tasks into lists rendered one after the other by the same
+        server. In a session export, the notes sharing a soloed module are
+        played in one session, velocity layers included, split in as many parts
+        as there are processes. Otherwise the lists hold the files rendered at once, the
+        tracks of job.batch notes in a stems export.
+        """
+        if tasks is None:
+            tasks = self.tasks
+        if not self.job.session:
+            size = self.getVoiceCount()
+            return [tasks[i:i + size] for i in range(0, len(tasks), size)]
+        groups = {}
+        for task in tasks:
+            groups.setdefault(task["track"], []).append(task)
+        batches = []
+        for tasks in groups.values():
+            size = int(math.ceil(len(tasks) / self.job.processes))
+            batches.extend([tasks[i:i + size] for i in range(0, len(tasks), size)])
+        return batches
+
+    def renderBatch(self, tasks, callback=None):
+        """
+        Renders a list of tasks from getBatches(). Returns False if the
+        export was cancelled by the callback.
+        """
+        if not self.job.session and len(tasks) > 1:
+            for i, task in enumerate(tasks):
+                count = self.rendered + self.cached + self.resumed + i + 1
+                if callback is not None and not callback(count, len(self.tasks), task["name"]):
+                    return False
+            self.renderChannels(tasks)
+            self.rendered += len(tasks)
+            return True
+        if self.job.session:
+            self.startSession([tasks[0]])
+        try:
+            for task in tasks:
+                count = self.rendered + self.cached + self.resumed + 1
+                if callback is not None and not callback(count, len(self.tasks), task["name"]):
+                    return False
+                if self.job.session:
+                    self.renderNote(task)
+                else:
+                    self.render(task)
+                self.rendered += 1
+        finally:
+            if self.job.session:
+                self.stopSession()
+        return True
+
+    def getTaskKey(self, batch, i):
+        "Returns the hash of the settings the file of the i-th task of `batch` depends on."
+        task = batch[i]
+        if task["track"] is None:
+            tracks = range(len(self.patch["modules"]))
+        else:
+            tracks = [task["track"]]
+        modules = []
+        for j in tracks:
+            lfos = [[lfo["state"], lfo["params"]] for lfo in self.patch["lfo_params"][j]]
+            modules.append([self.patch["modules"][j], self.patch["params"][j], lfos])
+        settings = [vars.constants["VERSION"], vars.vars["PYO_PRECISION"], self.patch["server"],
+                    self.patch["postproc"], modules, self.job.noteon, self.job.release,
+                    self.job.tailthresh, self.job.tailhold, self.job.trimthresh, self.job.fadeout,
+                    self.job.fileformat, self.job.sampletype, self.seed, self.job.loop,
+                    self.job.loopcut, self.job.draft, self.job.upsample,
+                    task["pitch"], task["velocity"]]
+        if self.job.session:
+            # a note of a session depends on the notes played before
+            settings.append([[t["pitch"], t["velocity"]] for t in batch[:i]])
+        elif self.seed and len(batch) > 1:
+            # pyo draws the random values of all voices of a server from one generator,
+            # a seeded note depends on the notes rendered with it and on its voice
+            settings.append([self.job.batch, self.job.stems, i,
+                             [[t["pitch"], t["velocity"], t["track"]] for t in batch]])
+        return get_settings_key(settings)
+
+    def takeFromJournal(self, batches):
+        """
+        Keeps the files of the interrupted export whose settings and content
+        didn't change since they were written in the journal and returns the
+        batches still to render. A session is only kept as a whole.
+        """
+        remaining = []
+        for batch in batches:
+            finished = [self.isFinished(task) for task in batch]
+            if self.job.session and not all(finished):
+                remaining.append(batch)
+                continue
+            for task, done in zip(batch, finished):
+                if done:
+                    task["analysis"] = self.journal.get(task["name"])["analysis"]
+                    outputs = self.job.getOutputs(task["name"])
+                    task["normgains"] = {name: self.journal.get(name)["gain"]
+                                         for name, _, _ in outputs}
+                    self.resumed += 1
+                elif not self.job.session:
+                    remaining.append(task)
+        if self.job.session:
+            return remaining
+        return self.getBatches(remaining)
+
+    def isFinished(self, task):
+        for name, fileformat, sampletype in self.job.getOutputs(task["name"]):
+            entry = self.journal.get(name)
+            # a file normalized before the interruption is rendered again for an export without
+            # normalization
+            if entry is not None and entry["gain"] is not None and self.job.normalize is None:
+                return False
+            key = self.getOutputKey(task, fileformat, sampletype)
+            if not self.journal.isValid(name, key, os.path.join(self.job.getExportPath(), name)):
+                return False
+        return True
+
+    def getOutputKey(self, task, fileformat, sampletype):
+        "Returns the key of a file of the task, see ExportJob.getOutputs()."
+        if (fileformat, sampletype) == (self.job.fileformat, self.job.sampletype):
+            return task["key"]
+        return get_settings_key([task["key"], fileformat, sampletype])
+
+    def addToJournal(self, task, name=None, gain=None):
+        "Writes the files of a task in the journal, or only its file `name`."
+        if self.journal is None:
+            return
+        for output, fileformat, sampletype in self.job.getOutputs(task["name"]):
+            if name is None or output == name:
+                path = os.path.join(self.job.getExportPath(), output)
+                self.journal.add(output, self.getOutputKey(task, fileformat, sampletype), path,
+                                 task["analysis"], gain)
+
+    def takeFromCache(self, batches):
+        """
+        Copies the cached files to the export folder and returns the batches
+        still to render. A session is only taken from the cache as a whole, the
+        other batches are built again from the remaining files.
+        """
+        remaining = []
+        for batch in batches:
+            if self.job.session and not all(self.isCached(task) for task in batch):
+                remaining.append(batch)
+                continue
+            for task in batch:
+                if self.isCached(task):
+                    for name, fileformat, sampletype in self.job.getOutputs(task["name"]):
+                        self.cache.restore(self.getOutputKey(task, fileformat, sampletype),
+                                           os.path.join(self.job.getExportPath(), name))
+                    path = os.path.join(self.job.getExportPath(), task["name"])
+                    task["analysis"] = self.cache.getAnalysis(task["key"]) or analyze_file(path)
+                    self.addToJournal(task)
+                    self.cached += 1
+                elif not self.job.session:
+                    remaining.append(task)
+        if self.job.session:
+            return remaining
+        return self.getBatches(remaining)
+
+    def isCached(self, task):
+        return all(self.cache.has(self.getOutputKey(task, fileformat, sampletype))
+                   for name, fileformat, sampletype in self.job.getOutputs(task["name"]))
+
+    def storeInCache(self, task):
+        if self.cache is None:
+            return
+        for name, fileformat, sampletype in self.job.getOutputs(task["name"]):
+            self.cache.store(self.getOutputKey(task, fileformat, sampletype),
+                             os.path.join(self.job.getExportPath(), name), task["analysis"])
+
+    def run(self, callback=None):
+        """
+        Renders all tasks. `callback(count, total, name)` is called before each
+        rendering, returning False cancels the export. In parallel exports it is
+        called once a file is written.
+        """
+        subrootpath = self.job.getExportPath()
+        folders = [subrootpath] + [os.path.join(subrootpath, self.job.getFormatFolder(*fmt))
+                                   for fmt in self.job.getExtraFormats()]
+        for folder in folders:
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+        starttime = time.time()
+        self.rendered = 0
+        self.cached = 0
+        self.resumed = 0
+        self.cancelled = False
+        batches = self.getBatches()
+        for batch in batches:
+            for i, task in enumerate(batch):
+                task["key"] = self.getTaskKey(batch, i)
+        self.journal = ExportJournal(subrootpath, self.job.resume)
+        try:
+            if self.job.resume:
+                batches = self.takeFromJournal(batches)
+            if self.cache is not None:
+                batches = self.takeFromCache(batches)
+            if self.job.processes > 1 and len(batches) > 1:
+                self.runParallel(batches, callback)
+            elif len(batches):
+                self.setup()
+                try:
+                    for batch in batches:
+                        if not self.renderBatch(batch, callback):
+                            self.cancelled = True
+                            break
+                finally:
+                    self.cleanup()
+            if self.job.normalize is not None and not self.cancelled:
+                self.normalize()
+        finally:
+            self.journal.close()
+            self.journal = None
+            if self.cache is not None:
+                self.cache.save()
+        self.writeManifest()
+        self.elapsed = time.time() - starttime
+
+    def runParallel(self, batches, callback=None):
+        # workers are spawned, not forked, a running audio server can't be shared
+        settings = {key: vars.vars[key] for key in ["PYO_PRECISION", "CUSTOM_MODULES_PATH"]}
+        if self.job.draft:
+            settings["PYO_PRECISION"] = "single"
+        ctx = multiprocessing.get_context("spawn")
+        processes = min(self.job.processes, len(batches))
+        # the pool starts all of its processes when it is created
+        with exportworker.worker_main():
+            pool = ctx.Pool(processes, initializer=exportworker.init_worker,
+                            initargs=(settings, self.patch, pickle.dumps(self.job)))
+        tasks = {task["name"]: task for task in self.tasks}
+        try:
+            for results in pool.imap_unordered(exportworker.render_batch, batches):
+                for name, analysis in results:
+                    tasks[name]["analysis"] = analysis
+                    self.rendered += 1
+                    self.storeInCache(tasks[name])
+                    self.addToJournal(tasks[name])
+                    count = self.rendered + self.cached + self.resumed
+                    if callback is not None and not callback(count, len(self.tasks), name):
+                        self.cancelled = True
+                        return
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def normalize(self):
+        """
+        Second pass of the set-wide normalization. The peaks and loudness of all
+        files were collected by their analysis, one common gain is applied to
+        the files in place, in every format. The files of a resumed export
+        normalized before the interruption only get the difference to their
+        former gain.
+        """
+        if exportanalysis.numpy is None:
+            print("The normalization of the exported files needs numpy.")
+            return
+        tasks = [task for task in self.tasks if "analysis" in task]
+        peak = max([task["analysis"].get("peak") or 0. for task in tasks] + [0.])
+        if peak <= 0.:
+            return
+        # highest gain keeping all peaks below 0 dBFS
+        maxgain = -20 * math.log10(peak)
+        if self.job.normalize == "peak":
+            gain = self.job.normtarget + maxgain
+        else:
+            loudness = [task["analysis"]["lufs"] for task in tasks
+                        if task["analysis"].get("lufs") is not None]
+            if not loudness:
+                print("The exported files are too short or too quiet for a loudness normalization.")
+                return
+            gain = self.job.normtarget - max(loudness)
+            if gain > maxgain:
+                print("Normalization: the gain is limited by the peaks to %.2f dB." % maxgain)
+                gain = maxgain
+        factor = p_mathpow(10.0, gain * 0.05)
+        for task in tasks:
+            applied = task.get("normgains", {})
+            for name, _, _ in self.job.getOutputs(task["name"]):
+                if applied.get(name) != gain:
+                    apply_gain(os.path.join(self.job.getExportPath(), name),
+                               p_mathpow(10.0, (gain - (applied.get(name) or 0.)) * 0.05))
+                    # the journal keeps the analysis of the file before its normalization
+                    self.addToJournal(task, name, gain)
+            analysis = dict(task["analysis"])
+            for key in ["peak", "rms", "dc"]:
+                analysis[key] = round(analysis[key] * factor, 6)
+            if analysis["lufs"] is not None:
+                analysis["lufs"] = round(analysis["lufs"] + gain, 2)
+            task["analysis"] = analysis
+        self.normgain = gain
+
+    def writeManifest(self):
+        entries = []
+        for task in self.tasks:
+            if "analysis" not in task:
+                continue
+            track = None
+            if task["track"] is not None:
+                track = self.patch["modules"][task["track"]][0]
+            entry = {"file": task["name"], "note": task["note"], "velocity": task["layer"],
+                     "track": track}
+            entry.update(task["analysis"])
+            entries.append(entry)
+        if entries:
+            write_manifest(self.job.getExportPath(), entries)
+
+    def getReport(self):
+        if self.rendered == 0:
+            report = "No file rendered."
+        else:
+            report = "%d files rendered in %.2f s (%.3f s per file)." % (
+                self.rendered, self.elapsed, self.elapsed / self.rendered)
+        if self.job.draft:
+            report += " Draft quality rendered at %d Hz." % DRAFT_SAMPLING_RATE
+        if self.cached:
+            report += " %d unchanged files taken from the export cache." % self.cached
+        if self.resumed:
+            report += " %d files kept from the interrupted export." % self.resumed
+        if self.normgain is not None:
+            report += " Normalized by %+.2f dB." % self.normgain
+        return report
@@ -0,0 +1,374 @@
+"""
+Copyright 2009-2015 Olivier Belanger - modifications by Hans-Jörg Bibiko 2022
+
+Analysis of exported samples for the export manifest: duration, peak, RMS,
+DC offset, spectral centroid and loudness. The samples are processed block
+by block while they are still at hand, right after the rendering. NumPy is
+used if it is installed, otherwise only the duration is given.
+
+The gain of the set-wide normalization is applied to the exported files in
+place, through memory maps, so that large files are never loaded at once.
+
+The loop points of sustained sounds are searched in the sustain segment:
+the autocorrelation gives the loop length whose repetition matches best,
+the loop is then placed at the beginning of the segment, its points at
+rising zero crossings of the mono sum where the waveforms match best.
+"""
+import csv
+import json
+import math
+import os
+from Resources.soundfiles import read_header, get_endian, get_frame_size
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+FFT_SIZE = 2048
+BLOCK_FRAMES = 32 * FFT_SIZE
+LOUDNESS_STEP = 0.1  # gating blocks of 400 ms overlap by 75 %
+LOOP_MIN_DURATION = 0.1
+LOOP_MATCH_FRAMES = 64  # half length of the waveforms compared around the loop points
+LOOP_SEARCH_FRAMES = 256  # the loop start is searched this far around the best loop length
+MANIFEST_FIELDS = ["file", "note", "velocity", "track", "duration", "peak", "rms", "dc", "centroid",
+                   "lufs", "loopstart", "loopend"]
+
+
+def k_weighting(freqs, sr):
+    """
+    Returns the power response of the K-weighting filter of ITU-R BS.1770
+    (high shelf and high pass biquads) at the frequencies `freqs` for the
+    sampling rate `sr`.
+    """
+    z = numpy.exp(-2j * math.pi * numpy.asarray(freqs) / sr)
+    # coefficients as in libebur128, equal to the ones given by the recommendation at 48 kHz
+    K = math.tan(math.pi * 1681.974450955533 / sr)
+    Q = 0.7071752369554196
+    Vh = 10 ** (3.999843853973347 / 20)
+    Vb = Vh ** 0.4996667741545416
+    shelf = ([Vh + Vb * K / Q + K * K, 2 * (K * K - Vh), Vh - Vb * K / Q + K * K],
+             [1 + K / Q + K * K, 2 * (K * K - 1), 1 - K / Q + K * K])
+    K = math.tan(math.pi * 38.13547087602444 / sr)
+    Q = 0.5003270373238773
+    a0 = 1 + K / Q + K * K
+    highpass = ([1, -2, 1], [1, 2 * (K * K - 1) / a0, (1 - K / Q + K * K) / a0])
+    response = 1.
+    for b, a in [shelf, highpass]:
+        response = response * (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+    return numpy.abs(response) ** 2
+
+
+def integrated_loudness(powers):
+    """
+    Returns the gated loudness in LUFS of the K-weighted mean squares (summed
+    over the channels) of successive LOUDNESS_STEP blocks, or None if the
+    sound is too short or silent.
+    """
+    steps = int(round(0.4 / LOUDNESS_STEP))
+    if len(powers) < steps:
+        return None
+    powers = numpy.asarray(powers)
+    blocks = numpy.convolve(powers, numpy.ones(steps) / steps, mode="valid")
+    blocks = blocks[blocks > 10 ** ((-70 + 0.691) / 10)]
+    if len(blocks) == 0:
+        return None
+    relative = blocks.mean() * 0.1
+    blocks = blocks[blocks > relative]
+    return -0.691 + 10 * math.log10(blocks.mean())
+
+
+def decode(header, data):
+    "Returns the samples of the raw sound file data `data` as a float array (frames, channels)."
+    endian = get_endian(header)
+    channels = header["channels"]
+    if header["float"]:
+        samples = numpy.frombuffer(data, dtype=endian + "f%d" % (header["bits"] // 8))
+        samples = samples.astype(numpy.float64)
+    elif header["bits"] == 24:
+        b = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, 3).astype(numpy.int32)
+        if endian == ">":
+            b = b[:, ::-1]
+        samples = (b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)) << 8 >> 8
+        samples = samples / float(1 << 23)
+    elif header["bits"] == 8 and header["fileformat"] == "wav":
+        # 8 bit WAV samples are unsigned
+        samples = (numpy.frombuffer(data, dtype=numpy.uint8) - 128.) / 128.
+    else:
+        samples = numpy.frombuffer(data, dtype=endian + "i%d" % (header["bits"] // 8))
+        samples = samples / float(1 << (header["bits"] - 1))
+    return samples.reshape(-1, channels)
+
+
+def encode(header, samples):
+    "Returns the float array `samples` (frames, channels) as raw sound file data (array of bytes)."
+    endian = get_endian(header)
+    if header["float"]:
+        return samples.astype(endian + "f%d" % (header["bits"] // 8)).reshape(-1).view(numpy.uint8)
+    full = 1 << (header["bits"] - 1)
+    return _pack(header, numpy.round(samples.reshape(-1) * full))
+
+
+def quantize(header, samples):
+    """
+    Returns the samples of a pyo table as raw sound file data, converted
+    to integers as libsndfile does it for the recordings of pyo: in single
+    precision, scaled by the largest positive value.
+    """
+    if header["float"]:
+        return encode(header, samples)
+    samples = samples.reshape(-1).astype(numpy.float32)
+    samples *= numpy.float32((1 << (header["bits"] - 1)) - 1)
+    return _pack(header, numpy.round(samples, out=samples))
+
+
+def _pack(header, values):
+    endian = get_endian(header)
+    full = 1 << (header["bits"] - 1)
+    values = numpy.clip(values, -full, full - 1, out=values).astype(endian + "i4")
+    if header["bits"] == 24:
+        # the three low bytes of each 32 bit integer
+        b = values.view(numpy.uint8).reshape(-1, 4)
+        return (b[:, :3] if endian == "<" else b[:, 1:]).reshape(-1)
+    if header["bits"] == 8 and header["fileformat"] == "wav":
+        return (values + 128).astype(numpy.uint8)
+    return values.astype(endian + "i%d" % (header["bits"] // 8)).view(numpy.uint8)
+
+
+def from_buffers(buffers, frames, gain=1.):
+    """
+    Returns the first `frames` samples of the channel buffers `buffers` (eg.
+    of a pyo table) multiplied by `gain`, as a float array of shape (frames,
+    channels) in the precision of the buffers. The buffers are read in place,
+    only the result is a new array.
+    """
+    samples = numpy.empty((frames, len(buffers)), dtype=numpy.asarray(buffers[0]).dtype)
+    for i, buf in enumerate(buffers):
+        numpy.multiply(numpy.asarray(buf)[:frames], gain, out=samples[:, i])
+    return samples
+
+
+def resample(samples, sr, newsr):
+    """
+    Returns the float array `samples` (frames, channels) converted from the
+    sampling rate `sr` to `newsr`, by zero padding or cropping its spectrum.
+    The samples are followed by silence as long as themselves before the
+    transform, so that the end doesn't wrap around into the beginning, and
+    the silence is cropped again.
+    """
+    frames = len(samples) * newsr // sr
+    if frames == len(samples) or len(samples) == 0:
+        return samples
+    # a whole number of frames at both rates keeps the samples aligned
+    step = sr // math.gcd(sr, newsr)
+    padded = -(-2 * len(samples) // step) * step
+    spectrum = numpy.fft.rfft(samples, padded, axis=0)
+    newframes = padded * newsr // sr
+    resampled = numpy.fft.irfft(spectrum, newframes, axis=0)[:frames] * (newframes / padded)
+    return resampled.astype(samples.dtype)
+
+
+def find_end(header, data, thresh):
+    "Returns the number of frames of `data` up to the last one above the amplitude `thresh`, or 0."
+    loud = numpy.nonzero(numpy.abs(decode(header, data)).max(axis=1) >= thresh)[0]
+    if len(loud) == 0:
+        return 0
+    return int(loud[-1]) + 1
+
+
+def fade_samples(samples, length):
+    "Returns a copy of the float array `samples` (frames, channels) faded out over `length` frames."
+    samples = numpy.array(samples)
+    length = min(len(samples), length)
+    if length > 0:
+        samples[len(samples) - length:] *= numpy.linspace(1., 0., length)[:, None]
+    return samples
+
+
+def fade_out(header, data, length):
+    "Returns the raw sample data `data` faded out linearly over its last `length` frames."
+    framesize = get_frame_size(header)
+    frames = len(data) // framesize
+    length = min(frames, length)
+    if length <= 0:
+        return data
+    start = (frames - length) * framesize
+    tail = fade_samples(decode(header, data[start:frames * framesize]), length)
+    return data[:start] + encode(header, tail).tobytes()
+
+
+def find_loop(samples, sr, start, end):
+    """
+    Returns the (start, end) frames, the end excluded, of the best loop of at
+    least LOOP_MIN_DURATION seconds between the frames `start` and `end` of
+    the float array `samples` (frames, channels), or None if the segment is
+    too short or silent.
+    """
+    w = LOOP_MATCH_FRAMES
+    start, end = max(start, w), min(end, len(samples) - w)
+    minlength = int(LOOP_MIN_DURATION * sr)
+    segment = samples[start:end]
+    n = len(segment)
+    if n < 2 * minlength or float(numpy.abs(segment).max()) < 1e-4:
+        return None
+    segment = segment - segment.mean(axis=0)
+    # autocorrelation through the power spectrum, zero padded against the circular wrap
+    size = 1 << (2 * n - 1).bit_length()
+    spectrum = numpy.fft.rfft(segment, size, axis=0)
+    corr = numpy.fft.irfft(numpy.abs(spectrum) ** 2, size, axis=0)[:n].sum(axis=1)
+    # normalized by the energies of the overlapping parts, for lags up to half the segment
+    energy = numpy.cumsum(numpy.square(segment).sum(axis=1))
+    lags = numpy.arange(minlength, n // 2 + 1)
+    norm = numpy.sqrt(energy[n - lags - 1] * (energy[-1] - energy[lags - 1]))
+    lag = int(lags[numpy.argmax(corr[lags] / numpy.maximum(norm, 1e-20))])
+
+    mono = samples.sum(axis=1)
+    rising = numpy.nonzero((mono[:-1] < 0) & (mono[1:] >= 0))[0] + 1
+    # the loop is placed at the beginning of the segment, a file cut after it stays short
+    ends = rising[(rising >= start + lag + LOOP_SEARCH_FRAMES) & (rising <= end)]
+    loopend = int(ends[0]) if len(ends) else min(end, start + lag + LOOP_SEARCH_FRAMES)
+    target = loopend - lag
+    starts = rising[(rising >= max(start, target - LOOP_SEARCH_FRAMES)) &
+                    (rising <= min(loopend - minlength, target + LOOP_SEARCH_FRAMES))]
+    candidates = [int(s) for s in starts] + [max(start, target)]
+    # the waveforms around both loop points must match for a smooth jump
+    after = samples[loopend - w:loopend + w]
+    errors = [float(numpy.square(samples[s - w:s + w] - after).sum()) for s in candidates]
+    return candidates[int(numpy.argmin(errors))], loopend
+
+
+class StreamAnalysis:
+    """
+    Accumulates the analysis of a sound given block by block with process()
+    as float arrays of shape (frames, channels).
+    The spectral centroid is the magnitude weighted mean frequency of the
+    spectra of successive FFT_SIZE frames of the mono sum. For the loudness,
+    the K-weighting is applied to the power spectra of LOUDNESS_STEP blocks.
+    """
+    def __init__(self, sr):
+        self.sr = sr
+        self.frames = 0
+        self.peak = 0.
+        self.sum = 0.
+        self.sumsq = 0.
+        self.count = 0
+        self.weighted = 0.
+        self.magnitudes = 0.
+        self.window = numpy.hanning(FFT_SIZE)
+        self.freqs = numpy.fft.rfftfreq(FFT_SIZE, 1. / sr)
+        self.rest = numpy.zeros(0)
+        self.step = int(round(sr * LOUDNESS_STEP))
+        self.stepWeights = k_weighting(numpy.fft.rfftfreq(self.step, 1. / sr), sr)
+        # bins counted twice in the power of a real signal
+        self.stepWeights[1:(self.step + 1) // 2] *= 2
+        self.stepRest = None
+        self.powers = []
+
+    def process(self, samples):
+        self.frames += len(samples)
+        if len(samples) == 0:
+            return
+        self.peak = max(self.peak, float(numpy.abs(samples).max()))
+        self.sum += float(samples.sum())
+        self.sumsq += float(numpy.square(samples).sum())
+        self.count += samples.size
+        mono = numpy.concatenate([self.rest, samples.mean(axis=1)])
+        usable = len(mono) // FFT_SIZE * FFT_SIZE
+        if usable:
+            self.addSpectra(mono[:usable].reshape(-1, FFT_SIZE))
+        self.rest = mono[usable:]
+        self.addLoudness(samples)
+
+    def addLoudness(self, samples):
+        if self.stepRest is not None:
+            samples = numpy.concatenate([self.stepRest, samples])
+        usable = len(samples) // self.step * self.step
+        if usable:
+            segments = samples[:usable].reshape(-1, self.step, samples.shape[1])
+            spectra = numpy.abs(numpy.fft.rfft(segments, axis=1)) ** 2
+            powers = (spectra * self.stepWeights[:, None]).sum(axis=(1, 2)) / self.step ** 2
+            self.powers.extend(powers.tolist())
+        self.stepRest = samples[usable:]
+
+    def addSpectra(self, segments):
+        mags = numpy.abs(numpy.fft.rfft(segments * self.window, axis=1))
+        self.weighted += float((mags * self.freqs).sum())
+        self.magnitudes += float(mags.sum())
+
+    def getResults(self):
+        results = {"duration": round(self.frames / self.sr, 6)}
+        if len(self.rest):
+            block = numpy.concatenate([self.rest, numpy.zeros(FFT_SIZE - len(self.rest))])
+            self.addSpectra(block[None, :])
+            self.rest = numpy.zeros(0)
+        count = max(1, self.count)
+        results["peak"] = round(self.peak, 6)
+        results["rms"] = round((self.sumsq / count) ** 0.5, 6)
+        results["dc"] = round(self.sum / count, 6)
+        centroid = self.weighted / self.magnitudes if self.magnitudes > 0 else 0.
+        results["centroid"] = round(centroid, 2)
+        loudness = integrated_loudness(self.powers)
+        results["lufs"] = round(loudness, 2) if loudness is not None else None
+        return results
+
+
+def analyze_data(header, data):
+    "Analyzes the raw sample data `data` of a sound file described by `header`."
+    if numpy is None:
+        return {"duration": round(len(data) // get_frame_size(header) / header["sr"], 6)}
+    analysis = StreamAnalysis(header["sr"])
+    blocksize = BLOCK_FRAMES * get_frame_size(header)
+    view = memoryview(data)
+    for start in range(0, len(data), blocksize):
+        analysis.process(decode(header, view[start:start + blocksize]))
+    return analysis.getResults()
+
+
+def analyze_file(path):
+    "Analyzes the sound file `path`, reading it block by block."
+    header = read_header(path)
+    framesize = get_frame_size(header)
+    if numpy is None:
+        return {"duration": round(header["size"] // framesize / header["sr"], 6)}
+    analysis = StreamAnalysis(header["sr"])
+    blocksize = BLOCK_FRAMES * framesize
+    with open(path, "rb") as f:
+        f.seek(header["offset"])
+        remaining = header["size"] // framesize * framesize
+        while remaining > 0:
+            data = f.read(min(blocksize, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            analysis.process(decode(header, data))
+    return analysis.getResults()
+
+
+def apply_gain(path, gain):
+    "Multiplies the samples of the sound file `path` by `gain`, in place and block by block."
+    header = read_header(path)
+    framesize = get_frame_size(header)
+    size = header["size"] // framesize * framesize
+    if size == 0:
+        return
+    data = numpy.memmap(path, dtype=numpy.uint8, mode="r+", offset=header["offset"], shape=(size,))
+    blocksize = BLOCK_FRAMES * framesize
+    for start in range(0, size, blocksize):
+        block = data[start:start + blocksize]
+        block[:] = encode(header, decode(header, block) * gain)
+    data.flush()
+    del data
+
+
+def write_manifest(path, entries):
+    """
+    Writes the list of dictionaries `entries` (with the keys of MANIFEST_FIELDS)
+    in the folder `path` as manifest.json and manifest.csv.
+    """
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump(entries, f, indent=1)
+    with open(os.path.join(path, "manifest.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(entries)
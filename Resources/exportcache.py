@@ -0,0 +1,110 @@
+"""
+Copyright 2009-2015 Olivier Belanger - modifications by Hans-Jörg Bibiko 2022
+
+Cache of exported samples. A rendered file is stored under the hash of all
+settings its rendering depends on, so an export only renders the files
+whose settings changed since a previous export. The least recently used
+files are removed once the cache exceeds its size.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import Resources.variables as vars
+
+
+def get_cache_root():
+    return os.path.join(os.path.expanduser("~"), vars.constants["EXPORT_CACHE_NAME"])
+
+
+def get_settings_key(settings):
+    "Returns the hash of the list of settings a rendered file depends on."
+    data = json.dumps(settings, sort_keys=True)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+class ExportCache:
+    """
+    Files are kept in the folder `path` and listed in its index file with
+    their size, last use and analysis for the export manifest. `maxsize` is
+    the size of the cache in MB.
+    """
+    def __init__(self, path=None, maxsize=None):
+        if path is None:
+            path = get_cache_root()
+        if maxsize is None:
+            maxsize = vars.vars["EXPORT_CACHE_SIZE"]
+        self.path = path
+        self.maxsize = int(maxsize) * 1024 * 1024
+        self.indexfile = os.path.join(self.path, "index.json")
+        self.index = {}
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self.index = self.readIndex()
+
+    def readIndex(self):
+        try:
+            with open(self.indexfile, "r") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def getPath(self, key):
+        return os.path.join(self.path, key)
+
+    def has(self, key):
+        return key in self.index and os.path.isfile(self.getPath(key))
+
+    def restore(self, key, path):
+        if not self.has(key):
+            return False
+        shutil.copyfile(self.getPath(key), path)
+        self.index[key]["used"] = time.time()
+        return True
+
+    def getAnalysis(self, key):
+        return self.index[key].get("analysis")
+
+    def store(self, key, path, analysis=None):
+        try:
+            shutil.copyfile(path, self.getPath(key))
+        except Exception as e:
+            print(f"Export cache: unable to store {path}:\n{e}")
+            return
+        self.index[key] = {"size": os.path.getsize(path), "used": time.time(), "analysis": analysis}
+
+    def merge(self):
+        # other processes may have stored files since the index was read, their entries are kept
+        for key, entry in self.readIndex().items():
+            if key not in self.index or self.index[key]["used"] < entry["used"]:
+                self.index[key] = entry
+        # files missing in the index, eg. of an interrupted process, still count and get evicted
+        for name in os.listdir(self.path):
+            if name not in self.index and re.fullmatch("[0-9a-f]{40}", name):
+                path = self.getPath(name)
+                self.index[name] = {"size": os.path.getsize(path), "used": os.path.getmtime(path),
+                                    "analysis": None}
+
+    def evict(self):
+        self.merge()
+        for key in [key for key in self.index if not os.path.isfile(self.getPath(key))]:
+            del self.index[key]
+        total = sum(entry["size"] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]["used"]):
+            if total <= self.maxsize:
+                break
+            total -= self.index[key]["size"]
+            try:
+                os.remove(self.getPath(key))
+            except Exception:
+                pass
+            del self.index[key]
+
+    def save(self):
+        self.evict()
+        tmpfile = self.indexfile + ".tmp"
+        with open(tmpfile, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmpfile, self.indexfile)
@@ -0,0 +1,70 @@
+"""
+Copyright 2009-2015 Olivier Belanger - modifications by Hans-Jörg Bibiko 2022
+
+Journal of the files finished by an export, kept in the export folder. Each
+finished file appends one line with the key of its settings, its size and
+checksum, its analysis and the normalization gain applied to it. The line
+is flushed to the disk at once, so that an export interrupted by a crash
+can be resumed: the files whose entry matches their settings and content
+are kept, the missing or corrupt ones are rendered again.
+"""
+import hashlib
+import json
+import os
+import threading
+
+
+JOURNAL_NAME = ".export_journal.jsonl"
+
+
+def file_checksum(path):
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class ExportJournal:
+    """
+    Journal of the export folder `path`. A new export starts an empty
+    journal, with `resume` the entries of the former one are kept.
+    """
+    def __init__(self, path, resume=False):
+        self.path = os.path.join(path, JOURNAL_NAME)
+        self.entries = {}
+        self.lock = threading.Lock()
+        if resume and os.path.isfile(self.path):
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except Exception:
+                        # the last line of a crashed export may be incomplete
+                        continue
+                    self.entries[entry["name"]] = entry
+        self.file = open(self.path, "a" if resume else "w")
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def isValid(self, name, key, path):
+        "Returns True if the file `path` was finished with the settings `key` and is unchanged."
+        entry = self.entries.get(name)
+        if entry is None or entry["key"] != key or not os.path.isfile(path):
+            return False
+        if os.path.getsize(path) != entry["size"]:
+            return False
+        return file_checksum(path) == entry["sha1"]
+
+    def add(self, name, key, path, analysis=None, gain=None):
+        entry = {"name": name, "key": key, "size": os.path.getsize(path),
+                 "sha1": file_checksum(path), "analysis": analysis, "gain": gain}
+        with self.lock:
+            self.entries[name] = entry
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
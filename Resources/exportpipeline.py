@@ -0,0 +1,48 @@
+"""
+Copyright 2009-2015 Olivier Belanger - modifications by Hans-Jörg Bibiko 2022
+
+Post-processing of exported files on worker threads. While the server
+renders the next notes, the files already rendered go through a chain of
+stages (trim, fade out, writing, analysis...).
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ExportPipeline:
+    """
+    Runs every item given to submit() through the functions of `stages`, one
+    after the other, on one of `threads` worker threads. Each stage takes an
+    item and returns it. At most `maxpending` items are waiting or running,
+    submit() waits for the oldest one otherwise.
+    """
+    def __init__(self, stages, threads=2, maxpending=8):
+        self.stages = stages
+        self.maxpending = maxpending
+        self.pending = []
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    def run(self, item):
+        for stage in self.stages:
+            item = stage(item)
+        return item
+
+    def submit(self, item):
+        while len(self.pending) >= self.maxpending:
+            self.pending.pop(0).result()
+        self.pending.append(self.executor.submit(self.run, item))
+
+    def join(self):
+        "Waits for all submitted items, then raises the first error of a stage if any."
+        error = None
+        while self.pending:
+            try:
+                self.pending.pop(0).result()
+            except Exception as e:
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+
+    def shutdown(self):
+        self.pending = []
+        self.executor.shutdown(wait=True)
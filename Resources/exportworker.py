@@ -0,0 +1,44 @@
+"""
+Copyright 2009-2015 Olivier Belanger - modifications by Hans-Jörg Bibiko 2022
+
+Worker processes of the parallel export. Each worker owns its own offline
+server. This module doesn't import pyo itself so that the settings of the
+main process (eg. the pyo precision) are set before the audio engine is
+loaded in the worker. The workers are started with this module as their
+main module, a spawned process otherwise imports the main script of the
+parent (Zyne.py loads wx and pyo) before its initializer runs.
+"""
+import contextlib
+import pickle
+import sys
+import Resources.variables as vars
+
+
+worker = {"exporter": None}
+
+
+@contextlib.contextmanager
+def worker_main():
+    "Processes spawned within the block import this module as their main module."
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = sys.modules[__name__]
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+def init_worker(settings, patch, job):
+    # the job is pickled by the caller, unpickling it imports the audio engine
+    vars.vars.update(settings)
+    from Resources.export import Exporter
+    exporter = Exporter(patch, pickle.loads(job))
+    exporter.setup()
+    worker["exporter"] = exporter
+
+
+def render_batch(tasks):
+    worker["exporter"].renderBatch(tasks)
+    # the analysis is ready once the post-processing is done
+    worker["exporter"].finishPostProcessing()
+    return [(task["name"], task["analysis"]) for task in tasks]
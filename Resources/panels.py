@@ -1,13 +1,13 @@
 """
 Copyright 2009-2015 Olivier Belanger - modifications by Hans-Jörg Bibiko 2022
 """
-import copy
 import os
 import random
 import time
 import wx
 import Resources.variables as vars
 from Resources.audio import *
+from Resources.modules import *
 from Resources.widgets import *
 from Resources.utils import toLog
 import wx.richtext as rt
@@ -20,113 +20,6 @@ WAVE_TITLES = {0: "Sine", 1: "Ramp", 2: "Sawtooth", 3: "Square", 4: "Triangle",
                5: "Pulse", 6: "Bipolar Pulse", 7: "Sample and Hold"}
 
 
-# Param values are: init, min, max, is_int, is_log
-MODULES = {
-            "FM": { "title": "Frequency Modulation", "synth": FmSynth,
-                    "p1": ["FM Ratio", 2, 1, 12, False, False],
-                    "p2": ["FM Index", 5, 0, 40, False, False],
-                    "p3": ["Lowpass Cutoff", 2000, 100, 18000, False, True],
-                    },
-            "Additive": { "title": "Additive Synthesis", "synth": AddSynth,
-                    "p1": ["Transposition", 0, -36, 36, True, False],
-                    "p2": ["Spread", 1, 0.001, 2, False, True],
-                    "p3": ["Feedback", 0, 0, 1, False, False]
-                    },
-            "Wind": { "title": "Wind Synthesis I", "synth": WindSynth,
-                    "p1": ["Rand Frequency", 1, 0.01, 20, False, True],
-                    "p2": ["Rand Depth", .1, .001, .25, False, False],
-                    "p3": ["Filter Q", 5, 1, 20, False, False]
-                    },
-            "SquareMod": { "title": "Square Modulation", "synth": SquareMod,
-                    "p1": ["Harmonics", 10, 1, 40, True, False],
-                    "p2": ["LFO Frequency", 1, .001, 20, False, False],
-                    "p3": ["LFO Amplitude", 1, 0, 1, False, False]
-                    },
-            "SawMod": { "title": "Sawtooth Modulation", "synth": SawMod,
-                    "p1": ["Harmonics", 10, 1, 40, True, False],
-                    "p2": ["LFO Frequency", 1, .001, 20, False, False],
-                    "p3": ["LFO Amplitude", 1, 0, 1, False, False]
-                    },
-            "Pulsar": { "title": "Pulsar Synthesis", "synth": PulsarSynth,
-                    "p1": ["Harmonics", 10, 1, 20, True, False],
-                    "p2": ["Transposition", 0, -36, 36, True, False],
-                    "p3": ["LFO Frequency", 1, .02, 200, False, True],
-                    },
-            "Ross": { "title": "Rossler Attractors", "synth": Ross,
-                    "p1": ["Chaos", 0.5, 0., 1., False, False],
-                    "p2": ["Chorus Depth", .001, .001, .125, False, True],
-                    "p3": ["Lowpass Cutoff", 5000, 100, 15000, False, True]
-                    },
-            "Wave": { "title": "Waveform Synthesis", "synth": Wave,
-                    "p1": ["Waveform", 0, 0, 7, True, False],
-                    "p2": ["Transposition", 0, -36, 36, True, False],
-                    "p3": ["Sharpness", 0.5, 0., 1., False, False],
-                    "slider_title_dicts": [
-                        {0: "Ramp (saw up)", 1: "Sawtooth", 2: "Square", 3: "Triangle",
-                         4: "Pulse", 5: "Bipolar pulse", 6: "Sample and Hold", 7: "Modulated sine"},
-                        None,
-                        None]
-                    },
-            "PluckedString": { "title": "Plucked String Synth", "synth": PluckedString,
-                    "p1": ["Transposition", 0, -48, 0, True, False],
-                    "p2": ["Duration", 30, .25, 60, False, False],
-                    "p3": ["Chorus Depth", .001, .001, .125, False, True]
-                    },
-            "Reson": { "title": "Resonators Synthesis", "synth": Reson,
-                    "p1": ["Transposition", 0, -36, 36, True, False],
-                    "p2": ["Chorus Depth", .001, .001, .125, False, True],
-                    "p3": ["Lowpass Cutoff", 5000, 100, 10000, False, True]
-                    },
-            "CrossFM": { "title": "Cross FM Modulation", "synth": CrossFmSynth,
-                    "p1": ["FM Ratio", 2, 1, 12, False, False],
-                    "p2": ["FM Index 1", 2, 0, 40, False, False],
-                    "p3": ["FM Index 2", 2, 0, 40, False, False],
-                    },
-            "OTReson": { "title": "Out of tune Resonators", "synth": OTReson,
-                    "p1": ["Transposition", 0, -36, 36, True, False],
-                    "p2": ["Detune", .01, .0001, 1, False, True],
-                    "p3": ["Lowpass Cutoff", 5000, 100, 10000, False, True]
-                    },
-            "InfiniteRev": { "title": "Infinite Reverb", "synth": InfiniteRev,
-                    "p1": ["Transposition", 0, -36, 36, True, False],
-                    "p2": ["Brightness", 5, 0, 100, True, False],
-                    "p3": ["Lowpass Cutoff", 10000, 100, 15000, False, True]
-                    },
-            "Degradation": { "title": "Wave Degradation", "synth": Degradation,
-                    "p1": ["Bit Depth", 6, 2, 8, False, True],
-                    "p2": ["SR Scale", .1, 0.001, .5, False, True],
-                    "p3": ["Lowpass Cutoff", 10000, 100, 15000, False, True]
-                    },
-            "PulseWidthMod": { "title": "Pulse Width Modulation", "synth": PulseWidthModulation,
-                    "p1": ["Detune", 0, 0, 1, True, False],
-                    "p2": ["Duty Cycle", 0.5, 0.01, 0.99, False, False],
-                    "p3": ["Lowpass Cutoff", 10000, 100, 15000, False, True]
-                   },
-            "VoltageControlledOsc": { "title": "Voltage Controlled Osc", "synth": VoltageControlledOsc,
-                    "p1": ["Transposition", 0, -36, 36, True, False],
-                    "p2": ["Shape", 0.5, 0, 1, False, False],
-                    "p3": ["Lowpass Cutoff", 10000, 100, 15000, False, True]
-                   },
-            "Sampler": { "title": "Sampler", "synth": ZB_Sampler,
-                    "p1": ["Loop Start Time (normalized)", 0., 0., 1., False, False],
-                    "p2": ["Loop Duration (normalized)", 0., 0., 1., False, False],
-                    "p3": ["Pitch", 1., 0., 4., False, False]
-        }
-}
-
-LFO_CONFIG = {"p1": ["Frequency", 4, .01, 1000, False, True],
-              "p2": ["Waveform", 0, 0, 7, True, False],
-              "p3": ["Jitter", 0, 0, 1, False, False],
-              "p4": ["Sharpness", 0.5, 0, 1, False, False]}
-
-LFO_INIT = {"state": False, "params": [.001, .1, .7, 1, 1, .1, 4, 0, 0, .5],
-            "ctl_params": [None, None, None, None, None, None, None, None, None, None], "shown": False}
-
-
-def get_lfo_init():
-    return copy.deepcopy(LFO_INIT)
-
-
 class MySamplerDropTarget(wx.FileDropTarget):
     def __init__(self, window):
         wx.FileDropTarget.__init__(self)
@@ -417,7 +310,11 @@ class BasePanel(wx.Panel):
             if self.sampler_path_text_ptsize is None:
                 self.sampler_path_text_ptsize = pt.GetFont().GetPointSize() - 2
             if len(path.strip()) > 0:
-                loaded = self.synth.loadSamples(path)
+                def progress(count, total):
+                    pt.SetLabel(f"Loading samples {count}/{total}")
+                    pt.Update()
+
+                loaded = self.synth.loadSamples(path, progress)
                 if loaded:
                     s = os.path.split(self.synth.path)[1]
                     self.mainFrame.refreshOutputSignal()
@@ -885,6 +782,10 @@ class GenericPanel(BasePanel):
             self.title.SetToolTip(wx.ToolTip(title))
 
         self.title.Bind(wx.EVT_LEFT_DOWN, self.selectModule)
+        if not self.synth.isSampler:
+            self.title.Bind(wx.EVT_RIGHT_DOWN, self.MouseRightDownTitle)
+            self.title.SetToolTip(wx.ToolTip(f"{title}. Right+Click to bake the module into a "
+                                             "sampler"))
 
         if vars.constants["IS_WIN"]:
             self.corner = wx.StaticText(self.headPanel, -1, label=" M|S ")
@@ -1099,6 +1000,13 @@ class GenericPanel(BasePanel):
         else:
             wx.LogMessage(f"No info for {self.name} module.")
 
+    def MouseRightDownTitle(self, evt):
+        menu = wx.Menu()
+        item = menu.Append(-1, "Bake to Sampler...")
+        self.Bind(wx.EVT_MENU, lambda e: wx.CallAfter(self.mainFrame.bakeModule, self), item)
+        self.title.PopupMenu(menu)
+        menu.Destroy()
+
     def selectModule(self, evt):
         if self.mainFrame.serverPanel.onOff.GetValue():
             return
@@ -0,0 +1,143 @@
+"""
+Copyright 2009-2015 Olivier Belanger - modifications by Hans-Jörg Bibiko 2022
+
+Cache of the decoded sampler files. The samples of a sound file, converted
+to the sampling rate of the server, are stored as raw floats in a .npy file
+which is memory mapped the next time the file is loaded, instead of being
+decoded again. The least recently used files are removed once the cache
+exceeds its size.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import Resources.variables as vars
+from Resources.exportanalysis import numpy
+
+
+def get_cache_root():
+    return os.path.join(os.path.expanduser("~"), vars.constants["SAMPLER_DISK_CACHE_NAME"])
+
+
+# changed with the decoding of the sound files, the samples decoded before aren't used anymore
+DECODER_VERSION = 3
+
+_cache = None
+
+
+def get_sample_cache():
+    "Returns the sample cache of the process, None if it is turned off or numpy is missing."
+    global _cache
+    if vars.vars["SAMPLER_DISK_CACHE_SIZE"] <= 0 or numpy is None:
+        return None
+    if _cache is None:
+        _cache = SampleDiskCache()
+    return _cache
+
+
+class SampleDiskCache:
+    """
+    Files are kept in the folder `path` and listed in its index file with
+    their size and last use. `maxsize` is the size of the cache in MB.
+    """
+    def __init__(self, path=None, maxsize=None):
+        if path is None:
+            path = get_cache_root()
+        if maxsize is None:
+            maxsize = vars.vars["SAMPLER_DISK_CACHE_SIZE"]
+        self.path = path
+        self.maxsize = int(maxsize) * 1024 * 1024
+        self.indexfile = os.path.join(self.path, "index.json")
+        self.changed = False
+        self.lock = threading.Lock()
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self.index = self.readIndex()
+
+    def readIndex(self):
+        try:
+            with open(self.indexfile, "r") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def getKey(self, path, sr, dtype):
+        "Returns the key of the samples of `path` at the sampling rate `sr` as `dtype`."
+        stat = os.stat(path)
+        data = json.dumps([os.path.realpath(path), stat.st_size, stat.st_mtime, sr,
+                           numpy.dtype(dtype).str, DECODER_VERSION])
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    def getPath(self, key):
+        return os.path.join(self.path, key + ".npy")
+
+    def load(self, key):
+        "Returns the samples of `key` as a read-only memory map (frames, channels) or None."
+        with self.lock:
+            if key not in self.index:
+                return None
+            try:
+                samples = numpy.load(self.getPath(key), mmap_mode="r")
+            except Exception:
+                del self.index[key]
+                self.changed = True
+                return None
+            self.index[key]["used"] = time.time()
+            self.changed = True
+            return samples
+
+    def store(self, key, samples):
+        path = self.getPath(key)
+        tmpfile = path + ".%d.%d.tmp" % (os.getpid(), threading.get_ident())
+        try:
+            with open(tmpfile, "wb") as f:
+                numpy.save(f, samples)
+            os.replace(tmpfile, path)
+        except Exception as e:
+            print(f"Sample cache: unable to store the samples:\n{e}")
+            return
+        with self.lock:
+            self.index[key] = {"size": os.path.getsize(path), "used": time.time()}
+            self.changed = True
+
+    def merge(self):
+        # other processes may have stored files since the index was read, their entries are kept
+        for key, entry in self.readIndex().items():
+            if key not in self.index or self.index[key]["used"] < entry["used"]:
+                self.index[key] = entry
+        # files missing in the index, eg. stored by an interrupted process, still count
+        for name in os.listdir(self.path):
+            key = name[:-4]
+            if name.endswith(".npy") and key not in self.index \
+                    and re.fullmatch("[0-9a-f]{40}", key):
+                path = self.getPath(key)
+                self.index[key] = {"size": os.path.getsize(path), "used": os.path.getmtime(path)}
+
+    def evict(self):
+        for key in [key for key in self.index if not os.path.isfile(self.getPath(key))]:
+            del self.index[key]
+        total = sum(entry["size"] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]["used"]):
+            if total <= self.maxsize:
+                break
+            total -= self.index[key]["size"]
+            try:
+                # a memory map of the file stays valid until it is closed
+                os.remove(self.getPath(key))
+            except Exception:
+                pass
+            del self.index[key]
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            self.merge()
+            self.evict()
+            tmpfile = self.indexfile + ".tmp"
+            with open(tmpfile, "w") as f:
+                json.dump(self.index, f)
+            os.replace(tmpfile, self.indexfile)
+            self.changed = False
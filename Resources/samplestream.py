@@ -0,0 +1,270 @@
+"""
+Copyright 2009-2015 Olivier Belanger - modifications by Hans-Jörg Bibiko 2022
+
+Disk streaming of the sampler module. Only the head and the tail of each
+sound file are kept in memory, the rest is read from disk on a background
+thread into a ring buffer per voice. This module doesn't import pyo, the ring buffers are
+the buffers of the sampler's tables, read through the buffer protocol.
+"""
+import threading
+import time
+from Resources.exportanalysis import decode, numpy
+from Resources.soundfiles import get_frame_size, read_header
+
+
+STREAM_RING = 65536  # frames of the ring buffer of a voice
+STREAM_HEAD = 32768  # frames of the head and of the tail of each file kept in memory
+STREAM_CHUNK = 8192  # smallest number of frames read at once
+STREAM_MARGIN = 4096  # frames ahead of the read position which are never overwritten
+STREAM_POLL = 0.01  # seconds between two passes of the reader thread
+
+
+class StreamFile:
+    """
+    A sound file played from disk, its first and last STREAM_HEAD frames are
+    kept in memory. The notes starting at the beginning of the file, or at
+    its end backward, begin with these frames while the reader catches up.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.header = read_header(path)
+        self.framesize = get_frame_size(self.header)
+        self.frames = self.header["size"] // self.framesize
+        self.sr = self.header["sr"]
+        self.head = self.readFrames(0, min(STREAM_HEAD, self.frames))
+        self.tailstart = max(len(self.head), self.frames - STREAM_HEAD)
+        self.tail = self.readFrames(self.tailstart, self.frames - self.tailstart)
+
+    def readFrames(self, start, count):
+        with open(self.path, "rb") as f:
+            f.seek(self.header["offset"] + start * self.framesize)
+            data = f.read(count * self.framesize)
+        samples = decode(self.header, data[:len(data) - len(data) % self.framesize])
+        if samples.shape[1] == 1:
+            samples = numpy.repeat(samples, 2, axis=1)
+        return samples[:, :2].astype(numpy.float32)
+
+    def read(self, start, stop, disk=True):
+        """
+        Returns the frames `start` to `stop` as a float array (frames, 2),
+        silence outside of the file. Without `disk`, only the frames kept in
+        memory are returned, None otherwise.
+        """
+        first, last = max(0, start), min(stop, self.frames)
+        if first >= last:
+            return numpy.zeros((stop - start, 2), dtype=numpy.float32)
+        if last <= len(self.head):
+            samples = self.head[first:last]
+        elif first >= self.tailstart:
+            samples = self.tail[first - self.tailstart:last - self.tailstart]
+        elif disk:
+            samples = self.readFrames(first, last - first)
+        else:
+            return None
+        if len(samples) < stop - start:
+            # the silence before and after the file
+            samples = numpy.pad(samples, ((first - start, stop - first - len(samples)), (0, 0)))
+        return samples
+
+
+class StreamVoice:
+    """
+    The frames of `sfile` in the order a voice plays them, like a Looper
+    reading the whole file. `start` and `end` are the loop points in frames,
+    `xfade` the crossfade of the loop in percent of its duration and
+    `fromloop` starts the playback at the loop instead of the beginning (or
+    the end, backward) of the file. The loop modes are those of the sampler:
+    0 plays the file once, 1 loops forward, 2 backward, 3 back and forth and
+    4 loops forward as long as the note is held, then plays on to the end of
+    the file.
+    """
+    def __init__(self, sfile, mode, start, end, xfade, fromloop):
+        self.file = sfile
+        self.mode = mode
+        self.start = start
+        self.end = end
+        self.xfade = 0
+        if mode > 0:
+            self.xfade = int((end - start) * min(xfade, 50) / 100.)
+        self.released = False
+        self.deadline = None
+        self.written = 0
+        self.played = 0
+        self.pieces = self.getPieces(fromloop)
+        self.piece = next(self.pieces)
+        self.offset = 0
+
+    def getPieces(self, fromloop):
+        """
+        Yields the parts of the playback: ("play", first, last, reverse) plays
+        the frames first to last, ("xfade", out, outreverse, in, inreverse)
+        crossfades from the xfade frames at `out` to the ones at `in`.
+        """
+        start, end, xfade = self.start, self.end, self.xfade
+        if self.mode == 0 or end <= start:
+            yield "play", 0, self.file.frames, False
+        elif self.mode == 2:
+            yield "play", start + xfade, end if fromloop else self.file.frames, True
+            while True:
+                yield "xfade", start, True, end - xfade, True
+                yield "play", start + xfade, end - xfade, True
+        elif self.mode == 3:
+            yield "play", start if fromloop else 0, end - xfade, False
+            while True:
+                yield "xfade", end - xfade, False, end - xfade, True
+                yield "play", start + xfade, end - xfade, True
+                yield "xfade", start, True, start, False
+                yield "play", start + xfade, end - xfade, False
+        else:
+            yield "play", start if fromloop else 0, end - xfade, False
+            while not (self.mode == 4 and self.released):
+                yield "xfade", end - xfade, False, start, False
+                yield "play", start + xfade, end - xfade, False
+            yield "play", end - xfade, self.file.frames, False
+
+    def getFrames(self, first, last, reverse, offset, count, disk):
+        if reverse:
+            samples = self.file.read(last - offset - count, last - offset, disk)
+            return None if samples is None else samples[::-1]
+        return self.file.read(first + offset, first + offset + count, disk)
+
+    def read(self, count, disk=True):
+        """
+        Returns the next `count` frames played, silence once the playback
+        ended. Without `disk`, the reading stops at the first frames not kept
+        in memory and fewer frames are returned.
+        """
+        frames = numpy.zeros((count, 2), dtype=numpy.float32)
+        done = 0
+        while done < count and self.piece is not None:
+            if self.piece[0] == "play":
+                first, last, reverse = self.piece[1:]
+                length = last - first
+            else:
+                length = self.xfade
+            n = min(count - done, length - self.offset)
+            if n > 0:
+                if self.piece[0] == "play":
+                    samples = self.getFrames(first, last, reverse, self.offset, n, disk)
+                else:
+                    out, outreverse, into, intoreverse = self.piece[1:]
+                    outsamples = self.getFrames(out, out + length, outreverse, self.offset, n,
+                                                disk)
+                    insamples = self.getFrames(into, into + length, intoreverse, self.offset, n,
+                                               disk)
+                    samples = None
+                    if outsamples is not None and insamples is not None:
+                        fade = self.getFade(self.offset, n)
+                        samples = outsamples * (1 - fade) + insamples * fade
+                if samples is None:
+                    frames = frames[:done]
+                    break
+                frames[done:done + n] = samples
+                done += n
+                self.offset += n
+            if self.offset >= length:
+                self.piece = next(self.pieces, None)
+                self.offset = 0
+        # like the Looper, the crossfade also fades in the beginning of the note
+        if self.played < self.xfade:
+            n = min(len(frames), self.xfade - self.played)
+            frames[:n] *= self.getFade(self.played, n)
+        self.played += len(frames)
+        return frames
+
+    def getFade(self, offset, count):
+        return (numpy.arange(offset, offset + count, dtype=numpy.float32) / self.xfade)[:, None]
+
+    def isFinished(self):
+        return self.piece is None or (self.deadline is not None and time.time() > self.deadline)
+
+
+class SampleStreamer:
+    """
+    Fills the ring buffers of the voices of a sampler on a background thread.
+    `rings` holds per voice the channel buffers of a stereo table of
+    STREAM_RING + 1 frames, the last frame repeating the first one for the
+    interpolation of the table reader.
+    """
+    def __init__(self, rings):
+        self.rings = [[numpy.asarray(buf) for buf in ring] for ring in rings]
+        self.voices = [None] * len(rings)
+        self.phases = [None] * len(rings)
+        self.lastPhases = [0.] * len(rings)
+        self.wraps = [0] * len(rings)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def start(self, i, voice, phase):
+        """
+        Plays `voice` on the i-th ring, read from its beginning at the position
+        returned by `phase`, normalized to the length of the table. The frames
+        of the voice kept in memory are written right away, the reader thread
+        streams the rest. It is called on note-on and never reads the disk.
+        """
+        frames = voice.read(min(STREAM_HEAD, STREAM_RING - STREAM_MARGIN), disk=False)
+        with self.lock:
+            # a note starting outside of the frames in memory is silent until the reader catches up
+            for buf in self.rings[i]:
+                buf[:] = 0
+            self.write(i, 0, frames)
+            voice.written = len(frames)
+            self.voices[i] = voice
+            self.phases[i] = phase
+            self.lastPhases[i] = 0.
+            self.wraps[i] = 0
+
+    def release(self, i, duration):
+        "Releases the note of the i-th ring, the ring is filled during `duration` seconds more."
+        voice = self.voices[i]
+        if voice is not None:
+            voice.released = True
+            voice.deadline = time.time() + duration + .1
+
+    def getReadPosition(self, i):
+        # the ring wraps once per turn of the phase, the reader thread passes several times per turn
+        phase = self.phases[i]() * (STREAM_RING + 1) / STREAM_RING
+        if phase < self.lastPhases[i]:
+            self.wraps[i] += 1
+        self.lastPhases[i] = phase
+        return int((self.wraps[i] + phase) * STREAM_RING)
+
+    def write(self, i, position, frames):
+        index = position % STREAM_RING
+        count = min(len(frames), STREAM_RING - index)
+        for chnl, buf in enumerate(self.rings[i]):
+            buf[index:index + count] = frames[:count, chnl]
+            buf[:len(frames) - count] = frames[count:, chnl]
+            buf[STREAM_RING] = buf[0]
+
+    def fill(self, i):
+        with self.lock:
+            voice = self.voices[i]
+            if voice is None:
+                return
+            if voice.isFinished():
+                self.voices[i] = None
+                return
+            position = self.getReadPosition(i)
+            free = position + STREAM_RING - STREAM_MARGIN - voice.written
+        if free < STREAM_CHUNK:
+            return
+        # the disk is read without the lock, the voice may have been replaced meanwhile
+        frames = voice.read(free)
+        # the frames the ring played while the note waited for the reader are dropped
+        skip = max(0, position - voice.written)
+        with self.lock:
+            if self.voices[i] is voice:
+                self.write(i, voice.written + skip, frames[skip:])
+                voice.written += len(frames)
+
+    def run(self):
+        while not self.stopped.wait(STREAM_POLL):
+            for i in range(len(self.voices)):
+                self.fill(i)
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
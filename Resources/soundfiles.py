@@ -0,0 +1,207 @@
+"""
+Copyright 2009-2015 Olivier Belanger - modifications by Hans-Jörg Bibiko 2022
+
+Minimal reading and writing of uncompressed WAV and AIFF files, as recorded
+by the pyo server. The samples are handled as raw bytes in the byte order
+of the file, so that channels can be taken out of a multichannel recording
+without converting them. Loop points are read from and written in the
+`smpl` chunk of WAV files and the MARK and INST chunks of AIFF files.
+"""
+import math
+import struct
+
+
+def _to_extended(value):
+    # 80 bit IEEE 754 extended float of the AIFF sampling rate
+    mantissa, exponent = math.frexp(value)
+    return struct.pack(">HQ", exponent + 16382, int(mantissa * 2 ** 64))
+
+
+def _from_extended(data):
+    exponent, mantissa = struct.unpack(">HQ", data)
+    return mantissa * 2.0 ** (exponent - 16383 - 63)
+
+
+def _chunks(f, endian):
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        ckid, size = struct.unpack(endian + "4sI", header)
+        pos = f.tell()
+        yield ckid, size, pos
+        f.seek(pos + size + (size & 1))
+
+
+def read_header(path):
+    """
+    Returns a dictionary describing the sound file `path`: "fileformat" ("wav"
+    or "aif"), "channels", "sr", "bits", "float" (True for floating point
+    samples), "endian" (the byte order of the samples, "<" or ">"), "offset"
+    and "size" of the sample data in bytes. If the file has loop points,
+    "loops" lists them as (start, end) frames, the end excluded, and "note" is
+    the MIDI note of the sample. Compressed and other unsupported formats
+    raise a ValueError.
+    """
+    header = {}
+    markers = {}
+    sustain = None
+    with open(path, "rb") as f:
+        riff, size, form = struct.unpack("<4sI4s", f.read(12))
+        if riff == b"RIFF" and form == b"WAVE":
+            header["fileformat"] = "wav"
+            endian = "<"
+        elif riff == b"FORM" and form in [b"AIFF", b"AIFC"]:
+            header["fileformat"] = "aif"
+            endian = ">"
+        else:
+            raise ValueError(f"{path} is not a WAV or AIFF file")
+        for ckid, size, pos in _chunks(f, endian):
+            if ckid == b"fmt ":
+                tag, channels, sr, _, _, bits = struct.unpack("<HHIIHH", f.read(16))
+                if tag == 0xFFFE:  # WAVE_FORMAT_EXTENSIBLE, the format is the subtype
+                    f.read(8)
+                    tag = struct.unpack("<H", f.read(2))[0]
+                if tag not in [1, 3]:
+                    raise ValueError(f"{path}: unsupported WAV format {tag:#x}")
+                header.update(channels=channels, sr=sr, bits=bits, float=tag == 3, endian="<")
+            elif ckid == b"COMM":
+                channels, frames, bits = struct.unpack(">hIh", f.read(8))
+                sr = _from_extended(f.read(10))
+                compression = b"NONE"
+                if form == b"AIFC":
+                    compression = f.read(4)
+                # twos and FL32 are other names of NONE and fl32, sowt is little-endian NONE
+                if compression not in [b"NONE", b"twos", b"sowt", b"fl32", b"FL32"]:
+                    raise ValueError(f"{path}: unsupported AIFF compression {compression}")
+                header.update(channels=channels, sr=int(sr), bits=bits,
+                              float=compression in [b"fl32", b"FL32"],
+                              endian="<" if compression == b"sowt" else ">")
+            elif ckid == b"data":
+                header.update(offset=pos, size=size)
+            elif ckid == b"SSND":
+                dataoffset = struct.unpack(">I", f.read(4))[0]
+                header.update(offset=pos + 8 + dataoffset, size=size - 8 - dataoffset)
+            elif ckid == b"smpl" and size >= 36:
+                values = struct.unpack("<9I", f.read(36))
+                count = min(values[7], (size - 36) // 24)
+                loops = []
+                for i in range(count):
+                    _, _, start, end, _, _ = struct.unpack("<6I", f.read(24))
+                    # the end of a WAV loop is its last frame
+                    loops.append((start, end + 1))
+                header.update(loops=loops, note=values[3])
+            elif ckid == b"MARK":
+                for i in range(struct.unpack(">H", f.read(2))[0]):
+                    marker, position, length = struct.unpack(">HIB", f.read(7))
+                    f.read(length + 1 - (length & 1))
+                    markers[marker] = position
+            elif ckid == b"INST":
+                note = struct.unpack(">b", f.read(1))[0]
+                f.read(7)
+                mode, begin, end = struct.unpack(">hhh", f.read(6))
+                header["note"] = note
+                if mode != 0:
+                    sustain = begin, end
+    if sustain is not None and sustain[0] in markers and sustain[1] in markers:
+        header["loops"] = [(markers[sustain[0]], markers[sustain[1]])]
+    if "channels" not in header or "offset" not in header:
+        raise ValueError(f"{path}: missing format or sample data")
+    if header["bits"] not in ([32, 64] if header["float"] else [8, 16, 24, 32]):
+        raise ValueError(f"{path}: unsupported sample size of {header['bits']} bits")
+    return header
+
+
+def read_frames(path):
+    "Returns the header of the sound file `path` and its sample data as bytes."
+    header = read_header(path)
+    with open(path, "rb") as f:
+        f.seek(header["offset"])
+        data = f.read(header["size"])
+    return header, data
+
+
+def get_endian(header):
+    "Returns the byte order of the samples of `header`, the headers of exports may not have one."
+    return header.get("endian", "<" if header["fileformat"] == "wav" else ">")
+
+
+def get_frame_size(header):
+    return header["bits"] // 8 * header["channels"]
+
+
+def split_channels(header, data, first, count, frames=None):
+    """
+    Returns the sample data of the `count` channels starting at channel
+    `first` of the interleaved `data`, limited to `frames` frames.
+    """
+    width = header["bits"] // 8
+    framesize = get_frame_size(header)
+    total = len(data) // framesize
+    if frames is None or frames > total:
+        frames = total
+    outsize = width * count
+    out = bytearray(frames * outsize)
+    # one byte column after the other, the slices run without a python loop over the frames
+    for b in range(outsize):
+        out[b::outsize] = data[first * width + b:frames * framesize:framesize]
+    return bytes(out)
+
+
+def write_soundfile(path, header, data):
+    """
+    Writes the sample data `data` in `path` in the format described by
+    `header` (see read_header). The data is written as is, it must already
+    be in the byte order of the file format. The "loops" of the header are
+    written as the sustain loop of the sampler chunks, with its "note".
+    """
+    channels, sr, bits = header["channels"], header["sr"], header["bits"]
+    width = bits // 8
+    pad = b"\x00" * (len(data) & 1)
+    loops = header.get("loops") or []
+    note = header.get("note", 60)
+    if header["fileformat"] == "wav":
+        tag = 3 if header["float"] else 1
+        fmt = struct.pack("<HHIIHH", tag, channels, sr, sr * width * channels, width * channels,
+                          bits)
+        chunks = [(b"fmt ", fmt)]
+        if header["float"]:
+            chunks.append((b"fact", struct.pack("<I", len(data) // (width * channels))))
+        if loops:
+            # sample period in nanoseconds, no SMPTE offset, forward loops played endlessly
+            smpl = struct.pack("<9I", 0, 0, int(round(1e9 / sr)), note, 0, 0, 0, len(loops), 0)
+            for i, (start, end) in enumerate(loops):
+                smpl += struct.pack("<6I", i, 0, start, end - 1, 0, 0)
+            chunks.append((b"smpl", smpl))
+        body = b"".join(struct.pack("<4sI", ckid, len(ck)) + ck for ckid, ck in chunks)
+        body += struct.pack("<4sI", b"data", len(data))
+        with open(path, "wb") as f:
+            f.write(struct.pack("<4sI4s", b"RIFF", 4 + len(body) + len(data) + len(pad), b"WAVE"))
+            f.write(body)
+            f.write(data)
+            f.write(pad)
+    else:
+        frames = len(data) // (width * channels)
+        comm = struct.pack(">hIh", channels, frames, bits) + _to_extended(sr)
+        if header["float"]:
+            form = b"AIFC"
+            name = b"\x0c32-bit float\x00"
+            comm += b"fl32" + name
+            chunks = [(b"FVER", struct.pack(">I", 0xA2805140)), (b"COMM", comm)]
+        else:
+            form = b"AIFF"
+            chunks = [(b"COMM", comm)]
+        if loops:
+            # AIFF knows one sustain loop, between two markers
+            start, end = loops[0]
+            mark = struct.pack(">HHI", 2, 1, start) + b"\x0aloop start\x00"
+            mark += struct.pack(">HI", 2, end) + b"\x08loop end\x00"
+            inst = struct.pack(">bbbbbbhhhhhhh", note, 0, 0, 127, 1, 127, 0, 1, 1, 2, 0, 0, 0)
+            chunks += [(b"MARK", mark), (b"INST", inst)]
+        body = b"".join(struct.pack(">4sI", ckid, len(ck)) + ck for ckid, ck in chunks)
+        body += struct.pack(">4sIII", b"SSND", len(data) + 8, 0, 0)
+        with open(path, "wb") as f:
+            f.write(struct.pack(">4sI4s", b"FORM", 4 + len(body) + len(data) + len(pad), form))
+            f.write(body)
+            f.write(data)
+            f.write(pad)
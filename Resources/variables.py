@@ -1,6 +1,12 @@
 import os
 import sys
-import wx
+
+try:
+    import wx
+    ID_EXIT, ID_PREFERENCES, ID_ABOUT = wx.ID_EXIT, wx.ID_PREFERENCES, wx.ID_ABOUT
+except ImportError:
+    # headless rendering (ZyneRender.py) works without wxPython
+    ID_EXIT, ID_PREFERENCES, ID_ABOUT = 5006, 5022, 5014
 
 
 constants = dict()
@@ -16,6 +22,8 @@ constants["PREF_FILE_NAME"] = ".Zyne_Brc"
 constants["ZYNE_B_FILE_EXT"] = ".zy"
 constants["DEFAULT_ZY_NAME"] = f"default{constants['ZYNE_B_FILE_EXT']}"
 constants["BACKUP_ZY_NAME"] = f"zyne_b_bkp{constants['ZYNE_B_FILE_EXT']}"
+constants["EXPORT_CACHE_NAME"] = ".Zyne_B_export_cache"
+constants["SAMPLER_DISK_CACHE_NAME"] = ".Zyne_B_sampler_cache"
 
 constants["HEADTITLE_BACKGROUND_COLOUR"] = "#9999A0"
 constants["HIGHLIGHT_COLOUR"] = "#2B60C8"
@@ -37,10 +45,10 @@ if not os.path.isdir(constants["RESOURCES_PATH"]) and constants["IS_WIN"]:
 
 constants["ID"] = {
     "New": 1000, "Open": 1001, "Save": 1002, "SaveAs": 1003, "Export": 1004,
-    "Quit": wx.ID_EXIT, "Prefs": wx.ID_PREFERENCES, "MidiLearn": 1007, "Run": 1008,
+    "Quit": ID_EXIT, "Prefs": ID_PREFERENCES, "MidiLearn": 1007, "Run": 1008,
     "ResetKeyboard": 1009, "ExportChord": 1010, "Retrig": 1011, "ExportTracks": 1012,
     "ExportChordTracks": 1013, "UpdateModules": 2000, "CheckoutModules": 2001,
-    "Modules": 1100, "About": wx.ID_ABOUT, "Tutorial": 6000, "MidiLearnHelp": 6001,
+    "Modules": 1100, "About": ID_ABOUT, "Tutorial": 6000, "MidiLearnHelp": 6001,
     "ExportHelp": 6002, "CloseTut": 7000, "CloseHelp": 7001, "CloseLFO": 7002,
     "DeSelect": 9998, "Select": 9999, "Uniform": 10000, "Triangular": 10001,
     "Minimum": 10002, "Jitter": 10003, "Duplicate": 10100,
@@ -52,12 +60,17 @@ constants["VAR_PREF_LABELS"] = {
     "AUTO_OPEN": 'Auto open default or last synth',
     "BITS": 'Exported sample type',
     "CUSTOM_MODULES_PATH": 'User-defined modules location',
+    "EXPORT_CACHE_SIZE": 'Export cache size in MB (0 = off)',
     "EXPORT_PATH": 'Prefered path for exported samples',
     "FORMAT": 'Exported soundfile format',
     "MIDI_INTERFACE": 'Prefered Midi interface',
     "OUTPUT_DRIVER": 'Prefered output driver',
     "POLY": 'Keyboard polyphony',
     "PYO_PRECISION": 'Internal sample precision',
+    "SAMPLER_CACHE_SIZE": 'Sampler memory per module in MB (0 = no limit)',
+    "SAMPLER_DISK_CACHE_SIZE": 'Sampler disk cache size in MB (0 = off)',
+    "SAMPLER_PRELOAD": 'Sampler folder loading',
+    "SAMPLER_STREAM_SIZE": 'Stream sampler files above MB (0 = off)',
     "SLIDERPORT": "Slider's portamento in seconds",
     "SR": 'Sampling rate',
 }
@@ -68,6 +81,7 @@ constants["VAR_CHOICES"] = {
     "FORMAT": ['wav', 'aif'],
     "POLY": list(map(str, range(1, 21))),
     "PYO_PRECISION": ['single', 'double'],
+    "SAMPLER_PRELOAD": ['Lazy', 'Full'],
     "SR": ['44100', '48000', '96000'],
     "CHANNEL_KEYBOARD": list(map(str, range(1, 16))),
     "CHANNEL": list(map(str, range(16))),
@@ -81,6 +95,7 @@ vars["AUDIO_HOST"] = "Portaudio"
 vars["AUTO_OPEN"] = "Default"
 vars["BITS"] = 24
 vars["CUSTOM_MODULES_PATH"] = ""
+vars["EXPORT_CACHE_SIZE"] = 1024
 vars["EXPORT_PATH"] = ""
 vars["FORMAT"] = 'wav'
 vars["LAST_SAVED"] = ""
@@ -90,6 +105,10 @@ vars["MIDI_INTERFACE"] = ""
 vars["OUTPUT_DRIVER"] = ""
 vars["POLY"] = 5
 vars["PYO_PRECISION"] = "double"
+vars["SAMPLER_CACHE_SIZE"] = 1024
+vars["SAMPLER_DISK_CACHE_SIZE"] = 0
+vars["SAMPLER_PRELOAD"] = "Lazy"
+vars["SAMPLER_STREAM_SIZE"] = 0
 vars["SLIDERPORT"] = 0.05
 vars["SR"] = 48000
 
@@ -123,7 +142,9 @@ def readPreferencesFile():
                                     and val in ["Jack", "Coreaudio"]:
                                 vars[key] = "Portaudio"
                                 vars["PREF_FILE_SETTINGS"][key] = vars[key]
-                            elif key in ["SR", "POLY", "BITS"]:
+                            elif key in ["SR", "POLY", "BITS", "EXPORT_CACHE_SIZE",
+                                         "SAMPLER_CACHE_SIZE", "SAMPLER_DISK_CACHE_SIZE",
+                                         "SAMPLER_STREAM_SIZE"]:
                                 vars[key] = int(val)
                                 vars["PREF_FILE_SETTINGS"][key] = vars[key]
                             elif key in ["SLIDERPORT"]:
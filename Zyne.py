@@ -2,12 +2,14 @@
 # encoding: utf-8
 
 import json
+import multiprocessing
 import os
 import psutil
 import sys
-import time
 import wx
 import Resources.audio as audio
+import Resources.export as export
+import Resources.exportcache as exportcache
 import Resources.tutorial as tutorial
 import Resources.variables as vars
 import wx.richtext as rt
@@ -103,7 +105,8 @@ class TutorialFrame(wx.Frame):
 
 
 class SamplingDialog(wx.Dialog):
-    def __init__(self, parent, title="Export Samples...", pos=wx.DefaultPosition, size=wx.DefaultSize, chords=False):
+    def __init__(self, parent, title="Export Samples...", pos=wx.DefaultPosition,
+                 size=wx.DefaultSize, chords=False, tracks=False, seed=0):
         wx.Dialog.__init__(self, parent, id=1, title=title, pos=pos, size=size)
         sizer = wx.BoxSizer(wx.VERTICAL)
         sizer.Add(wx.StaticText(self, -1, "Export settings for sampled sounds."), 0, wx.ALIGN_CENTRE | wx.ALL, 5)
@@ -134,7 +137,8 @@ class SamplingDialog(wx.Dialog):
             sizer.Add(box, 0, wx.GROW | wx.ALL, 5)
         else:
             box = wx.BoxSizer(wx.HORIZONTAL)
-            box.Add(wx.StaticText(self, -1, "MIDI velocity (1-127):"), 0, wx.ALIGN_LEFT | wx.ALL, 5)
+            box.Add(wx.StaticText(self, -1, "MIDI velocity (1-127) or layers:"), 0,
+                    wx.ALIGN_LEFT | wx.ALL, 5)
             self.velocity = wx.TextCtrl(self, -1, "90", size=(350, -1))
             box.Add(self.velocity, 1, wx.EXPAND | wx.ALIGN_LEFT | wx.ALL, 5)
             sizer.Add(box, 0, wx.GROW | wx.ALL, 5)
@@ -148,6 +152,78 @@ class SamplingDialog(wx.Dialog):
         box.Add(self.release, 1, wx.ALIGN_CENTRE | wx.ALL, 5)
         sizer.Add(box, 0, wx.GROW | wx.ALL, 5)
 
+        box = wx.BoxSizer(wx.HORIZONTAL)
+        box.Add(wx.StaticText(self, -1, "End tail below (dB):"), 0, wx.ALIGN_CENTRE | wx.ALL, 5)
+        self.tailthresh = wx.TextCtrl(self, -1, "", size=(50, -1))
+        box.Add(self.tailthresh, 1, wx.ALIGN_CENTRE | wx.ALL, 5)
+        box.Add(wx.StaticText(self, -1, "Hold:"), 0, wx.ALIGN_CENTRE | wx.ALL, 5)
+        self.tailhold = wx.TextCtrl(self, -1, "0.05", size=(50, -1))
+        box.Add(self.tailhold, 1, wx.ALIGN_CENTRE | wx.ALL, 5)
+        sizer.Add(box, 0, wx.GROW | wx.ALL, 5)
+
+        box = wx.BoxSizer(wx.HORIZONTAL)
+        box.Add(wx.StaticText(self, -1, "Trim below (dB):"), 0, wx.ALIGN_CENTRE | wx.ALL, 5)
+        self.trimthresh = wx.TextCtrl(self, -1, "", size=(50, -1))
+        box.Add(self.trimthresh, 1, wx.ALIGN_CENTRE | wx.ALL, 5)
+        box.Add(wx.StaticText(self, -1, "Fade out:"), 0, wx.ALIGN_CENTRE | wx.ALL, 5)
+        self.fadeout = wx.TextCtrl(self, -1, "0", size=(50, -1))
+        box.Add(self.fadeout, 1, wx.ALIGN_CENTRE | wx.ALL, 5)
+        sizer.Add(box, 0, wx.GROW | wx.ALL, 5)
+
+        box = wx.BoxSizer(wx.HORIZONTAL)
+        self.loop = wx.CheckBox(self, -1, "Find loop points")
+        box.Add(self.loop, 0, wx.ALIGN_CENTRE | wx.ALL, 5)
+        self.loopcut = wx.CheckBox(self, -1, "Cut after the loop")
+        box.Add(self.loopcut, 0, wx.ALIGN_CENTRE | wx.ALL, 5)
+        sizer.Add(box, 0, wx.GROW | wx.ALL, 5)
+
+        box = wx.BoxSizer(wx.HORIZONTAL)
+        box.Add(wx.StaticText(self, -1, "Also export as (eg. wav16, aif24):"), 0,
+                wx.ALIGN_CENTRE | wx.ALL, 5)
+        self.extraformats = wx.TextCtrl(self, -1, "", size=(120, -1))
+        box.Add(self.extraformats, 1, wx.ALIGN_CENTRE | wx.ALL, 5)
+        sizer.Add(box, 0, wx.GROW | wx.ALL, 5)
+
+        box = wx.BoxSizer(wx.HORIZONTAL)
+        box.Add(wx.StaticText(self, -1, "Normalize:"), 0, wx.ALIGN_CENTRE | wx.ALL, 5)
+        self.normalize = wx.Choice(self, -1, choices=["Off", "Peak (dBFS)", "Loudness (LUFS)"])
+        self.normalize.SetSelection(0)
+        box.Add(self.normalize, 1, wx.ALIGN_CENTRE | wx.ALL, 5)
+        box.Add(wx.StaticText(self, -1, "Target:"), 0, wx.ALIGN_CENTRE | wx.ALL, 5)
+        self.normtarget = wx.TextCtrl(self, -1, "", size=(50, -1))
+        box.Add(self.normtarget, 1, wx.ALIGN_CENTRE | wx.ALL, 5)
+        sizer.Add(box, 0, wx.GROW | wx.ALL, 5)
+
+        box = wx.BoxSizer(wx.HORIZONTAL)
+        box.Add(wx.StaticText(self, -1, "Parallel processes:"), 0, wx.ALIGN_CENTRE | wx.ALL, 5)
+        self.processes = wx.TextCtrl(self, -1, "1", size=(40, -1))
+        box.Add(self.processes, 1, wx.ALIGN_CENTRE | wx.ALL, 5)
+        box.Add(wx.StaticText(self, -1, "Notes at once:"), 0, wx.ALIGN_CENTRE | wx.ALL, 5)
+        self.batch = wx.TextCtrl(self, -1, "1", size=(40, -1))
+        box.Add(self.batch, 1, wx.ALIGN_CENTRE | wx.ALL, 5)
+        self.session = wx.CheckBox(self, -1, "One session")
+        box.Add(self.session, 0, wx.ALIGN_CENTRE | wx.ALL, 5)
+        sizer.Add(box, 0, wx.GROW | wx.ALL, 5)
+
+        if tracks:
+            self.stems = wx.CheckBox(self, -1, "All tracks of a note in one pass")
+            sizer.Add(self.stems, 0, wx.ALIGN_LEFT | wx.ALL, 10)
+
+        box = wx.BoxSizer(wx.HORIZONTAL)
+        self.draft = wx.CheckBox(self, -1, "Draft quality")
+        box.Add(self.draft, 0, wx.ALIGN_CENTRE | wx.ALL, 5)
+        self.upsample = wx.CheckBox(self, -1, "Upsample to the synth's sampling rate")
+        box.Add(self.upsample, 0, wx.ALIGN_CENTRE | wx.ALL, 5)
+        sizer.Add(box, 0, wx.GROW | wx.ALL, 5)
+
+        box = wx.BoxSizer(wx.HORIZONTAL)
+        box.Add(wx.StaticText(self, -1, "Seed (0 = random):"), 0, wx.ALIGN_CENTRE | wx.ALL, 5)
+        self.seed = wx.TextCtrl(self, -1, str(seed), size=(60, -1))
+        box.Add(self.seed, 1, wx.ALIGN_CENTRE | wx.ALL, 5)
+        self.resume = wx.CheckBox(self, -1, "Resume an interrupted export")
+        box.Add(self.resume, 0, wx.ALIGN_CENTRE | wx.ALL, 5)
+        sizer.Add(box, 0, wx.GROW | wx.ALL, 5)
+
         line = wx.StaticLine(self, -1, size=(20, -1), style=wx.LI_HORIZONTAL)
         sizer.Add(line, 0, wx.GROW | wx.RIGHT | wx.TOP, 5)
 
@@ -266,6 +342,7 @@ class ZyneFrame(wx.Frame):
         self.SetMenuBar(self.menubar)
 
         self.openedFile = ""
+        self.seed = 0
         self.modules = []
         self.selected = None
 
@@ -533,7 +610,80 @@ class ZyneFrame(wx.Frame):
         lines.append("The export samples window allows the user to create a bank of samples, mapped on a range of midi keys, from the actual state of the current synth.\n")
         lines.append("The path where the exported samples will be saved can be defined in the preferences panel. If not, a folder named 'zyne_export' will be created on the Desktop. Inside this folder, a subfolder will be created according to the string given in the field 'Common file name'. Samples will be saved inside this subfolder with automatic name incrementation.\n")
         lines.append("The fields 'First', 'Last' and 'Step' define which notes, in midi keys, will be sampled and exported. From 'First' to 'Last' in steps of 'Step'.\n")
+        lines.append("The field 'MIDI velocity' takes a velocity or a list of velocity layers "
+                     "separated by a comma, eg. '32,64,96,127'. All layers are rendered in one "
+                     "export and the velocity is added to the file names, eg. "
+                     "'060_v064_zyne.wav'.\n")
         lines.append("The fields 'Noteon dur' and 'Release dur' define the duration, in seconds, of the note part and the release part, respectively. The value in 'Noteon dur' should be equal or higher than the addition of the attack and the decay of the longest module. The value in the 'Release part' should be equal or higher than the longest release.\n")
+        lines.append("The field 'Parallel processes' defines how many samples are rendered at the "
+                     "same time, each by its own offline audio server. A value up to the number of "
+                     "CPU cores speeds up the export of large banks.\n")
+        lines.append("The field 'Notes at once' defines how many samples are rendered at the same "
+                     "time by one audio server, each of them on its own pair of output channels. "
+                     "The multichannel recording is then split into one file per sample. This "
+                     "can't be combined with 'One session'.\n")
+        lines.append("When exporting separated tracks, 'All tracks of a note in one pass' renders "
+                     "every module of a note at the same time, each of them on its own pair of "
+                     "output channels, instead of rendering the note once per module. The result "
+                     "equals the per-note rendering for deterministic synths only, random values "
+                     "and noise differ. This can't be combined with 'One session'.\n")
+        lines.append("If 'One session' is checked, the synth is built only once and all notes are "
+                     "played one after the other, which is faster for small synths. Oscillators "
+                     "and LFOs then run on from note to note, and tails longer than the 'Release "
+                     "dur' are heard at the beginning of the next sample.\n")
+        lines.append("If 'End tail below (dB)' is set, eg. to -80, the rendering of a sample stops "
+                     "as soon as its release stayed below that level during 'Hold' seconds. The "
+                     "sample is shortened accordingly, which saves time and disk space for "
+                     "percussive sounds.\n")
+        lines.append("The files manifest.json and manifest.csv of the export folder list the note, "
+                     "velocity, track, duration, peak, RMS, DC offset and spectral centroid of "
+                     "each sample. The analysis needs the Python package numpy, without it only "
+                     "the durations are given.\n")
+        lines.append("If 'Trim below (dB)' is set, eg. to -90, the end of each sample is cut after "
+                     "its last sample above that level. 'Fade out' fades out the end of each "
+                     "sample over the given duration in seconds. Trimming, fading out and the "
+                     "analysis of a sample run in the background while the next samples are "
+                     "rendered. They need the Python package numpy.\n")
+        lines.append("'Find loop points' searches a loop in the second half of the 'Noteon dur' of "
+                     "each sample of a sustained sound, where the repetition of the waveform "
+                     "matches best, and writes it in the smpl chunk of WAV files or the markers of "
+                     "AIFF files. The sampler module then loops over it after the attack. 'Cut "
+                     "after the loop' also ends each sample shortly after its loop, without "
+                     "release and fade out, which keeps long sustained samples short. It needs the "
+                     "Python package numpy.\n")
+        lines.append("A right click on the title of a module offers 'Bake to Sampler...'. The "
+                     "module is rendered alone over its key range into a folder of your choice, "
+                     "with loop points and cut after the loop, and is replaced by a Sampler module "
+                     "playing these samples with the envelope, amplitude and panning of the "
+                     "module. This saves the CPU of modules which are heavy at full polyphony.\n")
+        lines.append("'Also export as' takes a list of further formats separated by a comma, eg. "
+                     "'wav16, aif24' for 16 bit WAV and 24 bit AIFF files. Each sample is rendered "
+                     "once and written in every format, the files of each further format in a "
+                     "subfolder named after it. It needs the Python package numpy.\n")
+        lines.append("'Draft quality' renders a quick preview of a whole bank, several times "
+                     "faster: at 22050 Hz, with a single voice stream per module instead of one "
+                     "per polyphony voice, and in single precision in the parallel processes. "
+                     "Noise sources and heavy distortion can sound a bit different. 'Upsample to "
+                     "the synth's sampling rate' converts the draft samples to the sampling rate "
+                     "of the synth, it needs the Python package numpy.\n")
+        lines.append("'Normalize' applies one common gain to all exported samples once they are "
+                     "rendered, so that the level relations between the notes are kept. With 'Peak "
+                     "(dBFS)' the highest peak of all samples reaches the 'Target' level (default "
+                     "-1 dBFS), with 'Loudness (LUFS)' the loudest sample reaches the 'Target' "
+                     "loudness (default -16 LUFS) as long as no peak exceeds 0 dBFS. It needs the "
+                     "Python package numpy.\n")
+        lines.append("With a 'Seed' other than 0, the random values of the modules (eg. detuning "
+                     "and vibrato rates) and the noise sources are drawn from that seed, so that "
+                     "an export of the same synth with the same settings renders identical "
+                     "samples. The seed is saved with the synth.\n")
+        lines.append("Each finished sample is written with its checksum in a journal of the export "
+                     "folder. If an export was interrupted, eg. by a crash, 'Resume an interrupted "
+                     "export' keeps the samples written in the journal whose settings and content "
+                     "didn't change and only renders the missing or corrupt ones.\n")
+        lines.append("Exported samples are kept in an export cache whose size can be set in the "
+                     "preferences panel. Samples whose synth and export settings didn't change "
+                     "since a previous export are copied from the cache instead of being rendered "
+                     "again.\n")
         win = HelpFrame(self, -1, title="Export Samples Help", size=size, subtitle="How to use the export samples window.", lines=lines, from_module=False)
         win.CenterOnParent()
         win.Show(True)
@@ -642,6 +792,8 @@ class ZyneFrame(wx.Frame):
             return
         self.deleteAllModules()
         self.openedFile = ""
+        self.seed = 0
+        self.serverPanel.fsserver.setRandomSeed(self.seed)
         self.setServerPanelFooter("")
         self.SetTitle(f"{vars.constants['WIN_TITLE']} Synth")
         self.selected = None
@@ -689,152 +841,169 @@ class ZyneFrame(wx.Frame):
         if self.serverPanel.onOff.GetValue():
             return
         chords = False
+        tracks = evt.GetId() in [vars.constants["ID"]["ExportTracks"],
+                                 vars.constants["ID"]["ExportChordTracks"]]
         if evt.GetId() == vars.constants["ID"]["Export"]:
             mode = "Samples"
             title = "Export samples..."
             title2 = "Exporting samples..."
-            num_modules = 1
         elif evt.GetId() in [vars.constants["ID"]["ExportChord"], vars.constants["ID"]["ExportChordTracks"]]:
             chords = True
             if evt.GetId() == vars.constants["ID"]["ExportChord"]:
                 mode = "Chords"
                 title = "Export chords..."
                 title2 = "Exporting chords..."
-                num_modules = 1
             else:
                 mode = "ChordsTracks"
                 title = "Export chords as separated tracks..."
                 title2 = "Exporting chords as separated tracks..."
-                num_modules = len(self.modules)
         elif evt.GetId() == vars.constants["ID"]["ExportTracks"]:
             mode = "Tracks"
             title = "Export samples as separated tracks..."
             title2 = "Exporting samples as separated tracks..."
-            num_modules = len(self.modules)
-        dlg = SamplingDialog(self, title=title, size=(450, 310), chords=chords)
+        dlg = SamplingDialog(self, title=title, size=(450, 590 + 30 * tracks),
+                             chords=chords, tracks=tracks, seed=self.seed)
         dlg.CenterOnParent()
         if dlg.ShowModal() == wx.ID_OK:
 
             if chords:
-                try:
-                    chrds = dlg.notechords.GetValue().split(',')
-                    notes = []
-                    for c in chrds:
-                        s = c.split('/')
-                        if len(s) == 1:
-                            s.append(100)
-                        notes.append((int(s[0]), abs(int(s[1]))))
-                except Exception as e:
-                    wx.LogMessage("Please check input of chords. It may only contain positive and negative integers separated"
-                                  "by a comma or a slash.")
-                    return
-
-                pitch_factors = [n[0] for n in notes]
-                amp_factors_ = [n / 127 for n in [127 if n[1] > 127 else n[1] for n in notes]]
-                m_amp = sum(amp_factors_)
-                if m_amp < 1.:
-                    m_map = 1.
-                amp_factors = [a / m_amp for a in amp_factors_]
+                notes = {"chords": dlg.notechords.GetValue()}
             else:
-                try:
-                    velocity = abs(int(dlg.velocity.GetValue()))
-                    if velocity > 127:
-                        velocity = 1.
-                    elif velocity < 1:
-                        velocity = 1 / 127
-                    else:
-                        velocity /= 127
-                    velocity *= .33
-                except Exception as e:
-                    wx.LogMessage("Please check input for velocity. It may only contain a positive integer between 1 and 127.")
-                    return
+                notes = {"velocity": dlg.velocity.GetValue()}
+            if tracks:
+                notes["stems"] = dlg.stems.GetValue()
+            tailthresh = dlg.tailthresh.GetValue().strip() or None
+            normalize = [None, "peak", "lufs"][dlg.normalize.GetSelection()]
+            normtarget = dlg.normtarget.GetValue().strip() or None
+            trimthresh = dlg.trimthresh.GetValue().strip() or None
+            try:
+                job = export.ExportJob(mode, filename=dlg.filename.GetValue(),
+                                       first=int(dlg.first.GetValue()),
+                                       last=int(dlg.last.GetValue()),
+                                       step=int(dlg.step.GetValue()),
+                                       noteon=float(dlg.noteon.GetValue()),
+                                       release=float(dlg.release.GetValue()),
+                                       processes=int(dlg.processes.GetValue()),
+                                       session=dlg.session.GetValue(),
+                                       tailthresh=tailthresh,
+                                       tailhold=float(dlg.tailhold.GetValue()),
+                                       batch=int(dlg.batch.GetValue()), normalize=normalize,
+                                       normtarget=normtarget, trimthresh=trimthresh,
+                                       fadeout=float(dlg.fadeout.GetValue() or 0),
+                                       resume=dlg.resume.GetValue(),
+                                       seed=int(dlg.seed.GetValue() or 0),
+                                       extraformats=dlg.extraformats.GetValue(),
+                                       loop=dlg.loop.GetValue(), loopcut=dlg.loopcut.GetValue(),
+                                       draft=dlg.draft.GetValue(), upsample=dlg.upsample.GetValue(),
+                                       **notes)
+            except ValueError as e:
+                wx.LogMessage(f"Please check the export settings: {e}")
+                dlg.Destroy()
+                return
 
             keyboard_visible = self.serverPanel.keyboardShown
             if keyboard_visible:
                 self.showKeyboard(False)
 
-            if vars.vars["EXPORT_PATH"] and os.path.isdir(vars.vars["EXPORT_PATH"]):
-                rootpath = vars.vars["EXPORT_PATH"]
-            else:
-                rootpath = os.path.join(os.path.expanduser("~"), "Desktop", "zyne_export")
-                if not os.path.isdir(rootpath):
-                    os.mkdir(rootpath)
-            filename = dlg.filename.GetValue()
-            subrootpath = os.path.join(rootpath, filename)
-            if not os.path.isdir(subrootpath):
-                os.mkdir(subrootpath)
-            first = int(dlg.first.GetValue())
-            last = int(dlg.last.GetValue())
-            step = int(dlg.step.GetValue())
-            num_iter = len(range(first, last, step)) * num_modules
-            vars.vars["NOTEONDUR"] = float(dlg.noteon.GetValue())
-            duration = float(dlg.release.GetValue()) + vars.vars["NOTEONDUR"]
-            ext = self.serverPanel.getExtensionFromFileFormat()
-            modules, params, lfo_params, ctl_params = self.getModulesAndParams()
-            serverSettings = self.serverPanel.getServerSettings()
-            postProcSettings = self.serverPanel.getPostProcSettings()
-            self.deleteAllModules()
-            self.serverPanel.reinitServer(0.001, "offline", serverSettings, postProcSettings)
-            dlg2 = wx.ProgressDialog(title2, "", maximum=num_iter, parent=self,
-                                     style=wx.PD_APP_MODAL | wx.PD_AUTO_HIDE | wx.PD_SMOOTH)
+            # the seed of the export is saved with the synth
+            self.seed = job.seed
+            patch = self.getPatch()
+            try:
+                self.exportPatch(patch, job, title2)
+            finally:
+                self.setModulesAndParams(patch["modules"], patch["params"], patch["lfo_params"],
+                                         patch["ctl_params"])
+                if keyboard_visible:
+                    self.showKeyboard(True)
+                self.serverPanel.meter.setRms(*[0., 0.])
+                dlg.Destroy()
+        else:
+            dlg.Destroy()
+
+    def bakeModule(self, module):
+        if self.serverPanel.onOff.GetValue() or module.synth.isSampler:
+            return
+        dlg = wx.DirDialog(self, "Choose Folder for the Baked Samples...", export.get_export_root())
+        if dlg.ShowModal() != wx.ID_OK:
+            dlg.Destroy()
+            return
+        rootpath = dlg.GetPath()
+        dlg.Destroy()
+        index = self.modules.index(module)
+        job = export.ExportJob("Samples", filename="%s_%d_baked" % (module.name, index + 1),
+                               first=module.first, last=module.last + 1, velocity=127,
+                               rootpath=rootpath, seed=self.seed, loop=True, loopcut=True)
+
+        keyboard_visible = self.serverPanel.keyboardShown
+        if keyboard_visible:
+            self.showKeyboard(False)
+
+        patch = self.getPatch()
+        try:
+            exporter = self.exportPatch(export.get_bake_patch(patch, index), job,
+                                        "Baking %s..." % module.name)
+            if not exporter.cancelled:
+                # percussive sounds without loop points are played once
+                looped = all(task.get("analysis", {}).get("loopstart") is not None
+                             for task in exporter.tasks)
+                baked = export.get_baked_module(patch, index, job.getExportPath(), looped)
+                for key, value in zip(["modules", "params", "lfo_params", "ctl_params"], baked):
+                    patch[key][index] = value
+        finally:
+            self.setModulesAndParams(patch["modules"], patch["params"], patch["lfo_params"],
+                                     patch["ctl_params"])
+            if keyboard_visible:
+                self.showKeyboard(True)
+            self.serverPanel.meter.setRms(*[0., 0.])
+
+    def getPatch(self):
+        modules, params, lfo_params, ctl_params = self.getModulesAndParams()
+        return {"server": self.serverPanel.getServerSettings(),
+                "postproc": self.serverPanel.getPostProcSettings(),
+                "modules": modules, "params": params, "lfo_params": lfo_params,
+                "ctl_params": ctl_params, "seed": self.seed}
+
+    def exportPatch(self, patch, job, title):
+        """
+        Renders `patch` with the export settings `job` and returns the
+        Exporter. The modules are removed meanwhile, the caller restores them
+        even if the export fails.
+        """
+        job.fileformat = self.serverPanel.getExtensionFromFileFormat()
+        job.sampletype = self.serverPanel.sampletype
+        serverSettings, postProcSettings = patch["server"], patch["postproc"]
+        sliderport = vars.vars["SLIDERPORT"]
+        self.deleteAllModules()
+        dlg = None
+        try:
+            self.serverPanel.reinitServer(0.001, job.getServerAudio(), serverSettings,
+                                          postProcSettings)
+            cache = None
+            if vars.vars["EXPORT_CACHE_SIZE"] > 0:
+                cache = exportcache.ExportCache()
+            exporter = export.Exporter(patch, job, self.serverPanel.fsserver, cache)
+            dlg = wx.ProgressDialog(title, "", maximum=len(exporter.tasks), parent=self,
+                                    style=wx.PD_APP_MODAL | wx.PD_AUTO_HIDE | wx.PD_SMOOTH)
             if vars.constants["IS_WIN"]:
-                dlg2.SetSize((500, 125))
+                dlg.SetSize((500, 125))
             else:
-                dlg2.SetSize((500, 100))
-            count = 0
-            for i in range(first, last, step):
-                if mode == "Samples":
-                    vars.vars["MIDIPITCH"] = i
-                    vars.vars["MIDIVELOCITY"] = velocity
-                elif mode == "Chords":
-                    vars.vars["MIDIPITCH"] = [i + fac for fac in pitch_factors]
-                    vars.vars["MIDIVELOCITY"] = amp_factors
-                elif mode == "Tracks":
-                    vars.vars["MIDIPITCH"] = i
-                    vars.vars["MIDIVELOCITY"] = velocity
-                elif mode == "ChordsTracks":
-                    vars.vars["MIDIPITCH"] = [i + fac for fac in pitch_factors]
-                    vars.vars["MIDIVELOCITY"] = amp_factors
-                if mode in ["Samples", "Chords"]:
-                    self.setModulesAndParams(modules, params, lfo_params, ctl_params, True)
-                    self.serverPanel.setPostProcSettings(postProcSettings)
-                    name = "%03d_%s.%s" % (i, filename, ext)
-                    path = os.path.join(subrootpath, name)
-                    count += 1
-                    (keepGoing, skip) = dlg2.Update(count, "Exporting %s" % name)
-                    self.serverPanel.setRecordOptions(dur=duration, filename=path)
-                    self.serverPanel.start()
-                    time.sleep(0.25)
-                    self.deleteAllModules()
-                    self.serverPanel.shutdown()
-                    self.serverPanel.boot()
-                    time.sleep(0.25)
-                else:
-                    for j in range(num_modules):
-                        self.setModulesAndParams(modules, params, lfo_params, ctl_params, True)
-                        self.serverPanel.setPostProcSettings(postProcSettings)
-                        self.modules[j].setMute(2)
-                        name = "%03d_%s_track_%02d_%s.%s" % (i, filename, j, self.modules[j].name, ext)
-                        path = os.path.join(subrootpath, name)
-                        count += 1
-                        (keepGoing, skip) = dlg2.Update(count, "Exporting %s" % name)
-                        self.serverPanel.setRecordOptions(dur=duration, filename=path)
-                        self.serverPanel.start()
-                        time.sleep(0.25)
-                        self.deleteAllModules()
-                        self.serverPanel.shutdown()
-                        self.serverPanel.boot()
-                        time.sleep(0.25)
-            dlg2.Destroy()
-            self.serverPanel.reinitServer(vars.vars["SLIDERPORT"], vars.vars["AUDIO_HOST"], serverSettings, postProcSettings)
+                dlg.SetSize((500, 100))
+
+            def progress(count, total, name):
+                (keepGoing, skip) = dlg.Update(count, "Exporting %s" % name)
+                return keepGoing
+
+            exporter.run(progress)
+        finally:
+            # the live server comes back even if the export failed
+            if dlg is not None:
+                dlg.Destroy()
+            self.serverPanel.reinitServer(sliderport, vars.vars["AUDIO_HOST"], serverSettings,
+                                          postProcSettings)
             vars.vars["MIDIPITCH"] = None
             vars.vars["MIDIVELOCITY"] = 0.707
             self.serverPanel.setAmpCallable()
-            self.setModulesAndParams(modules, params, lfo_params, ctl_params)
-            if keyboard_visible:
-                self.showKeyboard(True)
-            self.serverPanel.meter.setRms(*[0., 0.])
-        dlg.Destroy()
+        return exporter
 
     def getModulesAndParams(self):
         modules = [module.getModuleParams() for module in self.modules]
@@ -964,7 +1133,7 @@ class ZyneFrame(wx.Frame):
             "server": serverSettings, "postproc": postProcSettings,
             "modules": modules, "params": params, "lfo_params": lfo_params,
             "ctl_params": ctl_params,
-            "output_driver": out_drv, "midi_interface": midi_itf
+            "output_driver": out_drv, "midi_interface": midi_itf, "seed": self.seed
         })
         if not filename.endswith(vars.constants["ZYNE_B_FILE_EXT"]):
             filename = f"{filename}{vars.constants['ZYNE_B_FILE_EXT']}"
@@ -1013,6 +1182,9 @@ class ZyneFrame(wx.Frame):
         if len(dic["modules"]) and len(dic["modules"][0]) == 2:  # update old set
             for m in dic["modules"]:
                 m.extend([0, 1, 127, 0, 127, 0, 0, 0, ""])
+        # a synth saved without a seed is randomized again
+        self.seed = dic.get("seed", 0)
+        self.serverPanel.fsserver.setRandomSeed(self.seed)
         self.setModulesAndParams(dic["modules"], dic["params"], dic["lfo_params"], dic["ctl_params"])
 
     def onAddModule(self, evt):
@@ -1056,16 +1228,7 @@ class ZyneFrame(wx.Frame):
         wx.CallAfter(self.OnSize, wx.CommandEvent())
 
     def refreshOutputSignal(self):
-        if len(self.modules) == 0:
-            out = Sig(0.0)
-        else:
-            for i, mod in enumerate(self.modules):
-                if i == 0:
-                    out = Sig(mod.synth.out)
-                else:
-                    out = out + Sig(mod.synth.out)
-        self.serverPanel.fsserver._modMix.value = out
-        self.serverPanel.fsserver._outSig.value = self.serverPanel.fsserver._modMix
+        self.serverPanel.fsserver.setModulesOutput([mod.synth.out for mod in self.modules])
 
     def refresh(self):
         self.panel.sizer.Layout()
@@ -1097,6 +1260,7 @@ class ZyneApp(wx.App):
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     file = None
     if len(sys.argv) >= 2:
         file = sys.argv[1]
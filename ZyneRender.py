@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+Renders the sample banks of a Zyne_B synth file (.zy) without starting the
+graphical interface - wxPython is not needed.
+
+Examples:
+    python3 ZyneRender.py mysynth.zy --first 36 --last 97 --velocity 100
+    python3 ZyneRender.py mysynth.zy --velocity 32,64,96,127
+    python3 ZyneRender.py mysynth.zy --mode Chords --chords "+4/120,-1/40,12"
+    python3 ZyneRender.py mysynth.zy --first 21 --last 109 --jobs 4
+    python3 ZyneRender.py mysynth.zy --mode Tracks --stems
+    python3 ZyneRender.py mysynth.zy --first 21 --last 109 --resume
+    python3 ZyneRender.py mysynth.zy --seed 1234
+    python3 ZyneRender.py mysynth.zy --bits 24 --extra-formats wav16,aif24
+    python3 ZyneRender.py mysynth.zy --noteon 3 --loop-cut
+    python3 ZyneRender.py mysynth.zy --first 21 --last 109 --draft --upsample
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import Resources.variables as vars
+from Resources.exportcache import ExportCache
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless sample export of Zyne_B synth files.")
+    parser.add_argument("zyfile", help="Zyne_B synth file (.zy)")
+    parser.add_argument("-m", "--mode", default="Samples",
+                        choices=["Samples", "Chords", "Tracks", "ChordsTracks"],
+                        help="export mode (default: Samples)")
+    parser.add_argument("-n", "--name", default=None,
+                        help="common file name of the exported samples (default: name of the synth "
+                             "file)")
+    parser.add_argument("-o", "--output", default=None,
+                        help="export folder (default: the export path of the preferences)")
+    parser.add_argument("--first", type=int, default=60, help="first midi note (default: 60)")
+    parser.add_argument("--last", type=int, default=72,
+                        help="last midi note, not included (default: 72)")
+    parser.add_argument("--step", type=int, default=1, help="midi note step (default: 1)")
+    parser.add_argument("--velocity", default="90",
+                        help="midi velocity 1-127, or velocity layers eg. '32,64,96,127' (default: "
+                             "90)")
+    parser.add_argument("--chords", default="+4/120,-1/40,12",
+                        help="chords as 'relative note/velocity' (default: '+4/120,-1/40,12')")
+    parser.add_argument("--noteon", type=float, default=1.,
+                        help="noteon duration in seconds (default: 1)")
+    parser.add_argument("--release", type=float, default=1.,
+                        help="release duration in seconds (default: 1)")
+    parser.add_argument("--format", choices=["wav", "aif"], default=None,
+                        help="soundfile format (default: from the synth file)")
+    parser.add_argument("--bits", type=int, choices=[16, 24, 32], default=None,
+                        help="sample type (default: from the synth file)")
+    parser.add_argument("--extra-formats", default=None, metavar="FORMATS",
+                        help="also write every file in these formats, eg. 'wav16,aif24', each in "
+                             "its own subfolder")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of files rendered in parallel (default: 1)")
+    parser.add_argument("-b", "--batch", type=int, default=1,
+                        help="number of notes rendered at once by one server, on separate channels "
+                             "(default: 1)")
+    parser.add_argument("--stems", action="store_true",
+                        help="Tracks modes: render all tracks of a note in one pass, on separate "
+                             "channels")
+    parser.add_argument("-s", "--session", action="store_true",
+                        help="build the synth once and play all notes in one server session")
+    parser.add_argument("--tail-thresh", type=float, default=None, metavar="DB",
+                        help="end a sample once its release stayed below this level in dB, eg. -80")
+    parser.add_argument("--tail-hold", type=float, default=.05,
+                        help="time in seconds the release must stay below --tail-thresh (default: "
+                             "0.05)")
+    parser.add_argument("--trim", type=float, default=None, metavar="DB",
+                        help="cut the end of each file after its last sample above this level in "
+                             "dB, eg. -90")
+    parser.add_argument("--fade-out", type=float, default=0., metavar="SEC",
+                        help="fade out the end of each file over this duration in seconds "
+                             "(default: 0)")
+    parser.add_argument("--loop", action="store_true",
+                        help="search loop points in the second half of the noteon and write them "
+                             "in the files")
+    parser.add_argument("--loop-cut", action="store_true",
+                        help="like --loop, and end each file shortly after its loop")
+    parser.add_argument("--normalize", choices=["peak", "lufs"], default=None,
+                        help="apply one gain to all files so that the highest peak or the loudest "
+                             "file reaches --target")
+    parser.add_argument("--target", type=float, default=None, metavar="DB",
+                        help="normalization target in dBFS or LUFS (default: -1 dBFS for peak, -16 "
+                             "LUFS for lufs)")
+    parser.add_argument("--resume", action="store_true",
+                        help="resume an interrupted export, only the missing or corrupt files are "
+                             "rendered")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed of the random values of the synths, 0 for random ones (default: "
+                             "from the synth file)")
+    parser.add_argument("--draft", action="store_true",
+                        help="quick draft rendering at 22050 Hz, in single precision and with one "
+                             "voice stream")
+    parser.add_argument("--upsample", action="store_true",
+                        help="convert the draft files to the sampling rate of the synth file")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="render all files, even the unchanged ones found in the export cache")
+    args = parser.parse_args()
+
+    # preferences decide between pyo and pyo64, read them before loading the audio engine
+    vars.readPreferencesFile()
+    if args.draft:
+        vars.vars["PYO_PRECISION"] = "single"
+    import Resources.export as export
+
+    if not os.path.isfile(args.zyfile):
+        print(f'No such file "{args.zyfile}".')
+        return 1
+    patch = export.load_patch(args.zyfile)
+    name = args.name
+    if name is None:
+        name = os.path.splitext(os.path.basename(args.zyfile))[0]
+
+    try:
+        job = export.ExportJob(args.mode, filename=name, first=args.first, last=args.last,
+                               step=args.step, velocity=args.velocity, chords=args.chords,
+                               noteon=args.noteon, release=args.release, rootpath=args.output,
+                               processes=args.jobs, session=args.session,
+                               tailthresh=args.tail_thresh,
+                               tailhold=args.tail_hold, batch=args.batch, stems=args.stems,
+                               normalize=args.normalize, normtarget=args.target,
+                               trimthresh=args.trim, fadeout=args.fade_out, resume=args.resume,
+                               seed=args.seed, extraformats=args.extra_formats, loop=args.loop,
+                               loopcut=args.loop_cut, draft=args.draft, upsample=args.upsample)
+    except Exception as e:
+        print(f"Please check the export settings: {e}")
+        return 1
+    serverSettings = patch["server"]
+    job.fileformat = args.format or export.FILE_FORMATS[serverSettings[3]]
+    job.sampletype = args.bits or export.SAMPLE_TYPES[serverSettings[2]]
+
+    def progress(count, total, name):
+        print(f"Exporting {name} ({count}/{total})")
+        return True
+
+    cache = None
+    if not args.no_cache and vars.vars["EXPORT_CACHE_SIZE"] > 0:
+        cache = ExportCache()
+    exporter = export.Exporter(patch, job, cache=cache)
+    exporter.run(progress)
+    print(exporter.getReport())
+    print(f"Samples exported to {job.getExportPath()}")
+    return 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Copyright 2009-2015 Olivier Belanger - modifications by Hans-Jörg Bibiko 2022
+
+Levels of draft exports compared to full quality exports of the same notes.
+Run from the root folder of Zyne_B with `python3 -m unittest discover tests`.
+"""
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import Resources.variables as vars
+
+if importlib.util.find_spec("pyo") is None or importlib.util.find_spec("numpy") is None:
+    raise unittest.SkipTest("the export tests need pyo and numpy")
+
+vars.readPreferencesFile()
+import numpy
+import Resources.export as export
+from Resources.exportanalysis import decode
+from Resources.soundfiles import read_frames
+
+
+PATCH = os.path.join(ROOT, "Resources", "default.zy")
+
+
+class DraftLevelTest(unittest.TestCase):
+    def setUp(self):
+        self.rootpath = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.rootpath)
+
+    def getRms(self, mode, draft, **kwargs):
+        "Renders the note 60 of the default synth and returns the RMS of its file."
+        name = "%s_%s" % (mode, "draft" if draft else "full")
+        job = export.ExportJob(mode, filename=name, first=60, last=61, noteon=.5, release=.2,
+                               rootpath=self.rootpath, draft=draft, **kwargs)
+        job.fileformat, job.sampletype = "wav", 24
+        exporter = export.Exporter(export.load_patch(PATCH), job)
+        exporter.run()
+        samples = decode(*read_frames(os.path.join(job.getExportPath(), "060_%s.wav" % name)))
+        return numpy.sqrt((samples ** 2).mean())
+
+    def assertSameLevel(self, mode, **kwargs):
+        full = self.getRms(mode, False, **kwargs)
+        draft = self.getRms(mode, True, **kwargs)
+        # the draft misses the partials above 11025 Hz
+        self.assertAlmostEqual(draft / full, 1., delta=.1)
+
+    def test_note(self):
+        self.assertSameLevel("Samples")
+
+    def test_chord(self):
+        # three notes sharing the voice streams unevenly
+        self.assertSameLevel("Chords", chords="+4/120,-1/40,12")
+
+
+if __name__ == '__main__':
+    unittest.main()